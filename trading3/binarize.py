@@ -1,6 +1,8 @@
-__all__ = ['get_vertical_barriers', 'apply_pt_sl_on_t1', 'get_events', 'triple_barrier_method', 'fixed_horizon']
+__all__ = ['get_vertical_barriers', 'barrier_touches', 'apply_pt_sl_on_t1', 'get_events', 'triple_barrier_method',
+           'fixed_horizon']
 
 # Cell
+import numpy as np
 import pandas as pd
 from .multiprocess import mp_pandas_obj
 from .utils import get_daily_vol
@@ -13,31 +15,77 @@ def get_vertical_barriers(close, t_events, num_days):
     return t1
 
 
+def barrier_touches(prices, starts, ends, side, pt, sl, max_block=2 ** 20):
+    """
+    For every path prices[starts[i]:ends[i]] find the first position whose side-adjusted return
+    relative to prices[starts[i]] rises above pt[i] (profit take) and falls below sl[i] (stop loss).
+    All paths are walked at once in chunks, so the cost is a handful of vectorized passes instead of
+    one pandas slice per event. A NaN barrier is never touched, -1 marks barriers that weren't touched.
+    """
+    n = len(starts)
+    pt_touch, sl_touch = np.full(n, -1, dtype=np.int64), np.full(n, -1, dtype=np.int64)
+    base = prices[starts.clip(max=len(prices) - 1)] if len(prices) else np.zeros(n)
+    pt_done, sl_done = np.isnan(pt), np.isnan(sl)
+    active = np.flatnonzero((starts < ends) & ~(pt_done & sl_done))
+    offset, chunk = 0, 64
+    while active.size:
+        # grow the chunk as paths get longer, but bound the block of prices we look at in one go
+        chunk = int(max(16, min(chunk * 2, max_block // active.size)))
+        pos = starts[active, None] + offset + np.arange(chunk)
+        in_path = pos < ends[active, None]
+        rets = (prices[np.minimum(pos, len(prices) - 1)] / base[active, None] - 1) * side[active, None]
+
+        for hit, touch, done in (
+            (rets > pt[active, None], pt_touch, pt_done),
+            (rets < sl[active, None], sl_touch, sl_done),
+        ):
+            hit &= in_path
+            first = hit.any(axis=1) & ~done[active]
+            rows = np.flatnonzero(first)
+            touch[active[rows]] = pos[rows, hit[rows].argmax(axis=1)]
+            done[active[rows]] = True
+
+        offset += chunk
+        exhausted = starts[active] + offset >= ends[active]
+        active = active[~(exhausted | (pt_done[active] & sl_done[active]))]
+
+    return pt_touch, sl_touch
+
+
 def apply_pt_sl_on_t1(close, events, pt_sl, molecule):
     # apply stop loss/profit taking, if it takes place before t1 (end of event)
     events_ = events.loc[molecule]
     out = events_[["t1"]].copy(deep=True)
 
+    trgt = events_["trgt"].values.astype(np.float64)
     if pt_sl[0] > 0:
-        pt = pt_sl[0] * events_["trgt"]
+        pt = pt_sl[0] * trgt
     else:
-        pt = pd.Series(index=events.index)  # NaNs
+        pt = np.full(trgt.shape, np.nan)  # NaNs
 
     if pt_sl[1] > 0:
-        sl = -pt_sl[1] * events_["trgt"]
+        sl = -pt_sl[1] * trgt
     else:
-        sl = pd.Series(index=events.index)  # 'mo NaNs
-
-    for loc, t1 in events_["t1"].fillna(close.index[-1]).iteritems():
-        df0 = close[loc:t1]  # path prices
-        df0 = (df0 / close[loc] - 1) * events_.at[loc, "side"]  # path returns
-        out.loc[loc, "sl"] = df0[df0 < sl[loc]].index.min()  # earliest stop loss
-        out.loc[loc, "pt"] = df0[df0 > pt[loc]].index.min()  # earliest profit take
+        sl = np.full(trgt.shape, np.nan)  # 'mo NaNs
+
+    # path of every event in positional terms, close[loc:t1] with both ends included
+    starts = close.index.searchsorted(events_.index, side="left")
+    ends = close.index.searchsorted(events_["t1"].fillna(close.index[-1]).values, side="right")
+    pt_touch, sl_touch = barrier_touches(
+        close.values.astype(np.float64),
+        starts,
+        ends,
+        events_["side"].values.astype(np.float64),
+        pt,
+        sl,
+    )
+    out["sl"] = close.index[sl_touch.clip(min=0)].where(sl_touch >= 0)  # earliest stop loss
+    out["pt"] = close.index[pt_touch.clip(min=0)].where(pt_touch >= 0)  # earliest profit take
     return out
 
 
 def get_events(
-    close, t_events, pt_sl, trgt, min_ret, num_threads=32, t1=False, side=None
+    close, t_events, pt_sl, trgt, min_ret, num_threads=32, t1=False, side=None, backend=None
 ):
     # 1) get target
     trgt = trgt.reindex(t_events)
@@ -53,10 +101,18 @@ def get_events(
     events = pd.concat({"t1": t1, "trgt": trgt, "side": side_}, axis=1).dropna(
         subset=["trgt"]
     )
+    # An event costs the length of its path, which gets longer as the vertical barriers move out.
+    # Molecules are cut to equal cost, and smaller ones let idle workers take over the slack
+    starts = close.index.searchsorted(events.index, side="left")
+    ends = close.index.searchsorted(events["t1"].fillna(close.index[-1]).values, side="right")
     df0 = mp_pandas_obj(
         func=apply_pt_sl_on_t1,
         pd_obj=("molecule", events.index),
         num_threads=num_threads,
+        mp_batches=4,
+        share_memory=True,
+        backend=backend,
+        costs=np.maximum(ends - starts, 1),
         close=close,
         events=events,
         pt_sl=pt_sl_,
@@ -72,7 +128,7 @@ def get_events(
     return events
 
 
-def triple_barrier_method(bars, t_events, params, daily_vol, num_threads=32):
+def triple_barrier_method(bars, t_events, params, daily_vol, num_threads=32, backend=None):
     target, pt, sl = params
     num_days = 100
     t1 = get_vertical_barriers(bars["Close"], t_events, num_days)
@@ -83,6 +139,7 @@ def triple_barrier_method(bars, t_events, params, daily_vol, num_threads=32):
         pt_sl=[pt, sl],
         t1=t1,
         num_threads=num_threads,
+        backend=backend,
         trgt=daily_vol * target,
         min_ret=0.0,
     )
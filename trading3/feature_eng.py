@@ -1,29 +1,105 @@
-__all__ = ['roll_measure', 'roll_impact', 'kyle', 'amihud', 'autocorr', 'stdev', 'log', 'ffd', 'volratio', 'get_bars',
-           'engineer_feature', 'compute_feature', 'define_features', 'define_feature_configs', 'SYMBOLS_CSV',
-           'SYMBOLS_DICT', 'FEATURES']
+__all__ = ['shift_values', 'prefix_sums', 'window_sums', 'rolling_mean', 'roll_measures', 'kyle_lambdas',
+           'amihud_lambdas', 'roll_measure', 'roll_impact', 'kyle', 'amihud', 'rolling_autocorr', 'autocorr', 'stdev',
+           'log', 'ffd', 'volratio', 'get_bars', 'engineer_feature', 'compute_feature', 'node_key', 'node_deps',
+           'NODES', 'add_node', 'plan_feature', 'plan_features', 'describe_node', 'describe_plan', 'compute_node',
+           'run_plan', 'compute_features', 'load_features', 'save_features', 'engineer_features', 'feature_groups',
+           'compute_features_job', 'engineer_deck_features', 'define_features', 'define_feature_configs', 'SYMBOLS_CSV',
+           'SYMBOLS_DICT', 'FEATURES', 'EWM_LOOKBACK_TOL', 'ewm_lookback', 'LOOKBACKS', 'feature_lookback',
+           'update_features']
 
 # Cell
-from mlfinlab.microstructural_features import (
-    get_roll_measure,
-    get_roll_impact,
-    get_bar_based_kyle_lambda,
-    get_bar_based_amihud_lambda,
-)
 import pandas as pd
 import numpy as np
 import logging
-from .load_data import load_feat, save_feat
-from .frac_diff import frac_diff_ffd
-from .load_data import get_data, SYMBOLS_CSV
+import time
+from .load_data import load_feats, save_feats, feat_store_symbol
+from .frac_diff import frac_diff_ffd, get_weights_ffd
+from .load_data import get_cached_data, SYMBOLS_CSV
+from .multiprocess import process_jobs, attach_arg, shared_args
 
 SYMBOLS_CSV = SYMBOLS_CSV.copy()
 SYMBOLS_CSV.columns = SYMBOLS_CSV.columns.str.lower()
 SYMBOLS_DICT = SYMBOLS_CSV.T.to_dict()
 
 
+def shift_values(values, lag):
+    shifted = np.full(values.shape, np.nan)
+    if lag < len(values):
+        shifted[lag:] = values[: len(values) - lag]
+    return shifted
+
+
+def prefix_sums(*values):
+    """
+    Prefix sums of the arrays over the positions at which all of them are finite, preceded by the count
+    of those positions. The sum over any window is then the difference of two prefix sums.
+    """
+    valid = np.logical_and.reduce([np.isfinite(x) for x in values])
+    sums = [np.concatenate([[0.0], np.cumsum(np.where(valid, x, 0.0))]) for x in values]
+    return [np.concatenate([[0], np.cumsum(valid)])] + sums
+
+
+def window_sums(prefix, window):
+    """Sums over every trailing window from prefix sums, NaN while the window isn't full yet"""
+    out = np.full(len(prefix) - 1, np.nan)
+    if window <= len(out):
+        out[window - 1:] = prefix[window:] - prefix[:-window]
+    return out
+
+
+def rolling_mean(sums, window, index):
+    # Like Series.rolling(window).mean(), a window with missing values has no mean
+    count, total = sums
+    mean = window_sums(total, window) / window
+    return pd.Series(np.where(window_sums(count, window) == window, mean, np.nan), index=index)
+
+
+def roll_measures(close, windows, sums=None):
+    """
+    The Roll measure 2 * sqrt(|cov(Δp_t, Δp_t-1)|) for every window, from prefix sums shared between the
+    windows. Pass the same `sums` dict to share them between calls on the same bars.
+    """
+    sums = {} if sums is None else sums
+    if "roll" not in sums:
+        diff = close.diff().values.astype(np.float64)
+        diff_lag = shift_values(diff, 1)
+        sums["roll"] = prefix_sums(diff, diff_lag, diff * diff_lag)
+    count, s_x, s_y, s_xy = sums["roll"]
+
+    out = {}
+    for window in windows:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            s_xy_w, s_x_w, s_y_w = window_sums(s_xy, window), window_sums(s_x, window), window_sums(s_y, window)
+            cov = (s_xy_w - s_x_w * s_y_w / window) / (window - 1)
+            roll = 2 * np.sqrt(np.abs(cov))
+        out[window] = pd.Series(np.where(window_sums(count, window) == window, roll, np.nan), index=close.index)
+    return out
+
+
+def kyle_lambdas(close, volume, windows, sums=None):
+    """
+    Bar-based Kyle lambda, the mean of Δp / (sign(Δp) * volume) for every window. Unchanged prices keep
+    the sign of the last change, so every bar's term is just |Δp| / volume.
+    """
+    sums = {} if sums is None else sums
+    if "kyle" not in sums:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            sums["kyle"] = prefix_sums((close.diff().abs() / volume).values.astype(np.float64))
+    return {window: rolling_mean(sums["kyle"], window, close.index) for window in windows}
+
+
+def amihud_lambdas(close, dollar_volume, windows, sums=None):
+    """Bar-based Amihud lambda, the mean of |log returns| / dollar volume for every window"""
+    sums = {} if sums is None else sums
+    if "amihud" not in sums:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            sums["amihud"] = prefix_sums((np.log(close).diff().abs() / dollar_volume).values.astype(np.float64))
+    return {window: rolling_mean(sums["amihud"], window, close.index) for window in windows}
+
+
 def roll_measure(df, window=20):
     """The Roll measure attempts to estimate the bid-ask spread (i.e. liquidity) of an instrument"""
-    return get_roll_measure(df["Close"], window)
+    return roll_measures(df["Close"], [window])[window]
 
 
 def roll_impact(df, window=20):
@@ -33,17 +109,54 @@ def roll_impact(df, window=20):
 
 def kyle(df, window=20):
     """A measure of market impact cost (i.e. liquidity) from Kyle (1985)"""
-    return get_bar_based_kyle_lambda(df["Close"], df["Volume"], window) * 1e9
+    return kyle_lambdas(df["Close"], df["Volume"], [window])[window] * 1e9
 
 
 def amihud(df, window=20):
     """A measure of market impact cost (i.e. liquidity) from Amihud (2002)"""
-    return get_bar_based_amihud_lambda(df["Close"], df["Dollar Volume"], window) * 1e9
+    return amihud_lambdas(df["Close"], df["Dollar Volume"], [window])[window] * 1e9
+
+
+def rolling_autocorr(close, windows_lags, sums=None):
+    """
+    Rolling serial correlation of close for every (window, lag) pair, i.e. Series.autocorr(lag) of every
+    window, from rolling sums of x, x² and x * x.shift(lag) over the window's window - lag pairs.
+    Sums are shared between pairs, so all pairs of a symbol cost about as much as a single one.
+    Pass the same `sums` dict to share them between calls on the same close.
+    """
+    # Correlations don't change with an offset, centering keeps the sums of squares well conditioned
+    x = close.values.astype(np.float64)
+    x = x - np.nanmean(x)
+    sums = {} if sums is None else sums
+
+    def rolling_sum(key, n, values):
+        if (key, n) not in sums:
+            sums[(key, n)] = pd.Series(values).rolling(n).sum().values
+        return sums[(key, n)]
+
+    out = {}
+    for window, lag in windows_lags:
+        n = window - lag
+        if n < 2:
+            out[(window, lag)] = pd.Series(np.nan, index=close.index)
+            continue
+        s_a, s_aa = rolling_sum("x", n, x), rolling_sum("xx", n, x * x)
+        s_b, s_bb = shift_values(s_a, lag), shift_values(s_aa, lag)
+        s_ab = rolling_sum(("xy", lag), n, x * shift_values(x, lag))
+
+        var_a, var_b = s_aa - s_a ** 2 / n, s_bb - s_b ** 2 / n
+        cov = s_ab - s_a * s_b / n
+        # Constant windows have no correlation, rounding would otherwise turn them into noise
+        flat = (var_a <= 1e-12 * s_aa) | (var_b <= 1e-12 * s_bb)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            corr = np.where(flat, np.nan, cov / np.sqrt(var_a * var_b))
+        out[(window, lag)] = pd.Series(corr, index=close.index, name=close.name)
+    return out
 
 
 def autocorr(df, window, lag):
     """The raw price series' serial correlation"""
-    return df["Close"].rolling(window).apply(lambda x: x.autocorr(lag=lag), raw=False)
+    return rolling_autocorr(df["Close"], [(window, lag)])[(window, lag)]
 
 
 def stdev(df, window):
@@ -84,6 +197,41 @@ FEATURES = {
     "sector": lambda df: df["Close"],
 }
 
+# EWMs depend on all history, we resume them from as many bars as it takes for the weight left out to
+# drop below this
+EWM_LOOKBACK_TOL = 1e-10
+
+
+def ewm_lookback(com):
+    return int(np.ceil(np.log(EWM_LOOKBACK_TOL) / np.log(com / (1.0 + com)))) if com > 0 else 0
+
+
+# How many bars before a row each feature needs to compute that row, f(**params)
+LOOKBACKS = {
+    "auto": lambda window, lag: window,
+    "stdev": lambda window: window,
+    "roll": lambda window: window + 1,
+    "rollimp": lambda window: window + 1,
+    "kyle": lambda window: window + 1,
+    "amihud": lambda window: window + 1,
+    "volratio": lambda com: ewm_lookback(com),
+    "log": lambda: 1,
+    "ffd": lambda d: len(get_weights_ffd(d, 1e-5)),
+    "close": lambda: 0,
+    "sector": lambda: 0,
+    "exchange": lambda: 0,
+}
+
+
+def feature_lookback(feat_conf):
+    """The bars a feature needs before a row to compute it, None if it needs all of them"""
+    symbol = feat_conf.get("symbol")
+    inner = feature_lookback(symbol) if isinstance(symbol, dict) else 0
+    if inner is None or feat_conf["name"] not in LOOKBACKS:
+        return None
+    params = {k: v for k, v in feat_conf.items() if k not in ["name", "symbol"]}
+    return inner + LOOKBACKS[feat_conf["name"]](**params)
+
 
 # def engineer_features(bars, features):
 # """Parse and compute features"""
@@ -100,11 +248,12 @@ FEATURES = {
 
 def get_bars(deck, symbol, config):
     if symbol in deck:
-        # TODO: Remove deep copy
-        bars = deck[symbol]['bars'].copy(deep=True)
+        # Shared read-only by all features, none of them modifies the bars they're given
+        bars = deck[symbol]['bars']
     else:
-        # We're loading a feature external to the price data of our trading universe
-        bars = get_data(symbol, "minutely", config["start_date"], config["end_date"])
+        # We're loading a feature external to the price data of our trading universe, which every symbol
+        # of the universe shares
+        bars = get_cached_data(symbol, "minutely", config["start_date"], config["end_date"])
 
     return bars
 
@@ -112,7 +261,7 @@ def get_bars(deck, symbol, config):
 def engineer_feature(deck, for_symbol, config, feat_conf):
     """Parse and compute a feature"""
     symbol = feat_conf['symbol'] = feat_conf.get('symbol', for_symbol)
-    feat = load_feat(config, feat_conf)
+    feat = load_feats(config, for_symbol, [feat_conf])[0]
     if feat is not None:
         return feat
 
@@ -126,8 +275,7 @@ def engineer_feature(deck, for_symbol, config, feat_conf):
 
     feat = compute_feature(deck, for_symbol, config, feat_conf, symbol, df)
 
-    if config["save_to_disk"]:
-        save_feat(config, feat_conf, feat)
+    save_feats(config, for_symbol, [feat_conf], [feat])
     return feat
 
 def compute_feature(deck, for_symbol, config, feat_conf, symbol, df):
@@ -147,6 +295,281 @@ def compute_feature(deck, for_symbol, config, feat_conf, symbol, df):
     return feat
 
 
+# Cell
+# Computing the features one config at a time recomputes what they have in common: roll_impact needs
+# the Roll measure, every autocorrelation the same rolling sums, every window of the Roll measure,
+# Kyle and Amihud lambdas the same prefix sums, log and ffd the log prices. So the
+# features a symbol needs are planned into a DAG of nodes keyed by (name, source, params) and every
+# node is computed once. Nodes are either features from FEATURES or one of the intermediates below.
+
+
+def node_key(name, source, params):
+    return (name, source, tuple(sorted(params.items())))
+
+
+def node_deps(name, params):
+    """The nodes (besides its bars) a node needs, as (name, params) pairs computed on the same bars"""
+    if name in ["log", "ffd"]:
+        return [("log_close", {})]
+    if name == "rollimp":
+        return [("roll", params)]
+    if name in ["roll", "kyle", "amihud"]:
+        return [("micro_sums", {})]
+    if name == "auto":
+        return [("autocorr_sums", {})]
+    if name == "volratio":
+        return [("buy_ratio", {})]
+    return []
+
+
+# Intermediates and the features that are computed from them, f(bars, *deps, **params)
+NODES = {
+    "log_close": lambda bars: np.log(bars["Close"]),
+    "autocorr_sums": lambda bars: {},
+    "buy_ratio": lambda bars: bars["Buy Volume"] / bars["Volume"],
+    "log": lambda bars, log_close: log_close.diff(),
+    "ffd": lambda bars, log_close, d: frac_diff_ffd(log_close.to_frame("Close"), d)["Close"],
+    "micro_sums": lambda bars: {},
+    "roll": lambda bars, sums, window: roll_measures(bars["Close"], [window], sums)[window],
+    "rollimp": lambda bars, roll, window: roll / bars["Dollar Volume"] * 1e9,
+    "auto": lambda bars, sums, window, lag: rolling_autocorr(bars["Close"], [(window, lag)], sums)[(window, lag)],
+    "kyle": lambda bars, sums, window: kyle_lambdas(bars["Close"], bars["Volume"], [window], sums)[window] * 1e9,
+    "amihud": lambda bars, sums, window: (
+        amihud_lambdas(bars["Close"], bars["Dollar Volume"], [window], sums)[window] * 1e9
+    ),
+    "volratio": lambda bars, buy_ratio, com: buy_ratio.ewm(com=com).mean(),
+}
+
+
+def add_node(plan, name, source, params):
+    """Add a node and (first) everything it depends on to plan, so plan's order is a topological one"""
+    key = node_key(name, source, params)
+    if key in plan:
+        return key
+    if name == "bars":
+        # bars are a symbol's price data or, for a feature on a feature, that feature's values
+        deps = [source] if isinstance(source, tuple) else []
+    else:
+        deps = [source] + [
+            add_node(plan, dep, source, dep_params) for dep, dep_params in node_deps(name, params)
+        ]
+    plan[key] = deps
+    return key
+
+
+def plan_feature(plan, feat_conf, for_symbol):
+    symbol = feat_conf.get("symbol", for_symbol)
+    if isinstance(symbol, dict):
+        # We're computing a feature on a feature
+        source = plan_feature(plan, symbol, for_symbol)
+    else:
+        source = symbol
+    bars = add_node(plan, "bars", source, {})
+    params = {k: v for k, v in feat_conf.items() if k not in ["name", "symbol"]}
+    return add_node(plan, feat_conf["name"], bars, params)
+
+
+def plan_features(feat_confs, for_symbol):
+    """Plan the DAG for a list of feature configs, returns the plan {node: deps} and each config's node"""
+    plan = {}
+    targets = [plan_feature(plan, x, for_symbol) for x in feat_confs]
+    return plan, targets
+
+
+def describe_node(key):
+    name, source, params = key
+    if name == "bars":
+        return f"bars({describe_node(source) if isinstance(source, tuple) else source})"
+    return f"{name}({', '.join(f'{k}={v}' for k, v in params)})"
+
+
+def describe_plan(plan):
+    return "\n".join(f"{describe_node(key)} <- {[describe_node(x) for x in deps]}" for key, deps in plan.items())
+
+
+def compute_node(deck, for_symbol, config, key, deps, values):
+    name, source, params = key
+    if name == "bars":
+        if isinstance(source, tuple):
+            return values[source].to_frame("Close")
+        return get_bars(deck, source, config)
+
+    bars, dep_values = values[deps[0]], [values[x] for x in deps[1:]]
+    if name in NODES:
+        return NODES[name](bars, *dep_values, **dict(params))
+
+    symbol = source[1]
+    feat_conf = {"name": name, **dict(params)}
+    return compute_feature(deck, for_symbol, config, feat_conf, symbol, bars)["Close"]
+
+
+def run_plan(deck, for_symbol, config, plan, targets):
+    """Compute every node of plan once, dropping intermediates as soon as nothing needs them anymore"""
+    consumers = {key: 0 for key in plan}
+    for deps in plan.values():
+        for dep in deps:
+            consumers[dep] += 1
+
+    values, timings = {}, {}
+    for key, deps in plan.items():
+        time0 = time.time()
+        values[key] = compute_node(deck, for_symbol, config, key, deps, values)
+        timings[key] = time.time() - time0
+        for dep in deps:
+            consumers[dep] -= 1
+            if not consumers[dep] and dep not in targets:
+                del values[dep]
+
+    return [values[x] for x in targets], timings
+
+
+def compute_features(deck, for_symbol, config, feat_confs):
+    """Compute a list of features for a symbol, computing what they share only once"""
+    plan, targets = plan_features(feat_confs, for_symbol)
+    logging.debug(f"Feature plan for {for_symbol} ({len(plan)} nodes for {len(feat_confs)} features):\n{describe_plan(plan)}")
+
+    computed, timings = run_plan(deck, for_symbol, config, plan, targets)
+    slowest = sorted(timings.items(), key=lambda x: -x[1])[:10]
+    logging.debug(
+        f"Computed {len(plan)} feature nodes for {for_symbol} in {sum(timings.values()):.2f}s, slowest: "
+        + ", ".join(f"{describe_node(key)} {t:.2f}s" for key, t in slowest)
+    )
+    return computed
+
+
+def load_features(config, for_symbol, feat_confs):
+    """Features of a symbol we already have on disk, and the positions of the ones we're missing"""
+    feat_confs = [dict(x, symbol=x.get("symbol", for_symbol)) for x in feat_confs]
+    feats = load_feats(config, for_symbol, feat_confs)
+    missing = [i for i, feat in enumerate(feats) if feat is None]
+    return feat_confs, feats, missing
+
+
+def update_features(deck, for_symbol, config, feat_confs, feats, missing):
+    """
+    Check loaded features against the bars they're computed on. Features whose bars got new rows since
+    they were saved are brought up to date by computing only the new rows from the last bars they need,
+    the ones that can't be are added to missing to be computed in full.
+    Returns the positions of the updated features and their values.
+    """
+    bars, stale = {}, {}
+    for i, feat in enumerate(feats):
+        if feat is None:
+            continue
+        symbol = feat_store_symbol(feat_confs[i], for_symbol)
+        if symbol not in bars:
+            bars[symbol] = get_bars(deck, symbol, config)
+        index, n = bars[symbol].index, len(feat)
+        if feat.index.equals(index):
+            continue
+        lookback = feature_lookback(feat_confs[i]) if config["incremental_features"] else None
+        if lookback is None or n >= len(index) or n <= lookback or not index[:n].equals(feat.index):
+            logging.debug(f"Recomputing {feat_confs[i]} for {for_symbol}, its bars changed")
+            feats[i] = None
+            missing.append(i)
+        else:
+            # Features with the same lookback are computed together, sharing their intermediates
+            stale.setdefault((symbol, n - lookback), []).append(i)
+    missing.sort()
+
+    positions, updated = [], []
+    for (symbol, start), features in stale.items():
+        n = len(feats[features[0]])
+        confs = [feat_confs[i] for i in features]
+        logging.debug(f"Updating {len(confs)} features of {symbol} for {for_symbol} with {len(bars[symbol]) - n} new bars")
+        tail = compute_features({**deck, symbol: {"bars": bars[symbol].iloc[start:]}}, for_symbol, config, confs)
+        for i, new in zip(features, tail):
+            positions.append(i)
+            updated.append(pd.concat([feats[i]["Close"], new.iloc[n - start:]]))
+    return positions, updated
+
+
+def save_features(config, for_symbol, feat_confs, feats, missing, computed, resumed=()):
+    """Save the computed features at positions `missing`, of which the ones in `resumed` are updates"""
+    for i, feat in zip(missing, computed):
+        # Every feature's column is called Close to enable easy recursion
+        feats[i] = feat.to_frame("Close")
+    save_feats(config, for_symbol, [feat_confs[i] for i in missing], [feats[i] for i in missing],
+               [j for j, i in enumerate(missing) if i in resumed])
+    return feats
+
+
+def engineer_features(deck, for_symbol, config, feat_confs):
+    """Parse and compute a list of features for a symbol, computing what they share only once"""
+    feat_confs, feats, missing = load_features(config, for_symbol, feat_confs)
+    positions, updated = update_features(deck, for_symbol, config, feat_confs, feats, missing)
+    if not missing and not positions:
+        return feats
+
+    computed = compute_features(deck, for_symbol, config, [feat_confs[i] for i in missing]) if missing else []
+    return save_features(config, for_symbol, feat_confs, feats, positions + missing, updated + computed, positions)
+
+
+def feature_groups(feat_confs, for_symbol):
+    """Split feature configs into groups that have no intermediates in common, as lists of positions"""
+    groups = []
+    for i, feat_conf in enumerate(feat_confs):
+        plan = {}
+        plan_feature(plan, feat_conf, for_symbol)
+        nodes, members = {key for key in plan if key[0] != "bars"}, [i]
+        for group in [x for x in groups if x[0] & nodes]:
+            groups.remove(group)
+            nodes, members = nodes | group[0], group[1] + members
+        groups.append((nodes, members))
+    return [sorted(members) for _, members in groups]
+
+
+def compute_features_job(for_symbol, symbol_bars, config, feat_confs):
+    deck = {symbol: {"bars": attach_arg(bars)} for symbol, bars in symbol_bars.items()}
+    return compute_features(deck, for_symbol, config, feat_confs)
+
+
+def engineer_deck_features(deck, config, num_workers=1, backend="processes"):
+    """
+    Load or compute config["features"] for every symbol in the deck, returning {symbol: [feature]}.
+    With num_workers > 1 every (symbol, group of features sharing intermediates) is a job on a pool of
+    `backend`. Bars are shared read-only with the workers, and loading/saving stays in this process.
+    """
+    if num_workers <= 1:
+        return {symbol: engineer_features(deck, symbol, config, config["features"]) for symbol in deck}
+
+    loaded, results, resumed, jobs, job_groups = {}, {}, {}, [], []
+    for symbol in deck:
+        feat_confs, feats, missing = loaded[symbol] = load_features(config, symbol, config["features"])
+        # Only the new rows are computed for updates, which isn't worth a job
+        results[symbol] = update_features(deck, symbol, config, feat_confs, feats, missing)
+        resumed[symbol] = list(results[symbol][0])
+        for group in feature_groups([feat_confs[i] for i in missing], symbol):
+            group_confs = [feat_confs[missing[i]] for i in group]
+            plan, _ = plan_features(group_confs, symbol)
+            bars_symbols = {x[1] for x in plan if x[0] == "bars" and not isinstance(x[1], tuple)}
+            jobs.append({
+                "func": compute_features_job,
+                "for_symbol": symbol,
+                "symbol_bars": {x: get_bars(deck, x, config) for x in bars_symbols},
+                "config": config,
+                "feat_confs": group_confs,
+            })
+            job_groups.append((symbol, [missing[i] for i in group]))
+    # Every symbol's bars, external series included, are written once and memory-mapped by the jobs
+    # that need them
+    all_bars = {symbol: bars for job in jobs for symbol, bars in job["symbol_bars"].items()}
+    with shared_args(all_bars, backend, "engineer_features_") as shared:
+        for job in jobs:
+            job["symbol_bars"] = {x: shared[x] for x in job["symbol_bars"]}
+        out = process_jobs(jobs, task="engineer_features", num_threads=num_workers, backend=backend) if jobs else []
+
+    for (symbol, positions), computed in zip(job_groups, out):
+        results[symbol][0].extend(positions)
+        results[symbol][1].extend(computed)
+    for symbol, (positions, computed) in results.items():
+        # Collected per symbol so that every feature store gets written once
+        if positions:
+            feat_confs, feats, _ = loaded[symbol]
+            save_features(config, symbol, feat_confs, feats, positions, computed, resumed[symbol])
+    return {symbol: feats for symbol, (_, feats, _) in loaded.items()}
+
+
 def define_features():
     """Stake out the list of features that is the basis for our features matrix"""
     features = ["log", "ffd_0.5"]
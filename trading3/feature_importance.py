@@ -1,13 +1,20 @@
-__all__ = ['feat_importance', 'feat_imp_MDI', 'feat_imp_MDA']
+__all__ = ['feat_importance', 'feat_imp_MDI', 'oob_proba_update', 'grow_ensemble', 'split_estimators', 'permutation',
+           'mda_job', 'mda_score', 'feat_imp_MDA', 'sfi_job', 'feat_imp_SFI', 'corr_distance', 'var_info_distance',
+           'CLUSTER_DISTANCES', 'cluster_features', 'expand_clusters', 'cluster_representatives']
 
 # Cell
 
 import pandas as pd
 import numpy as np
 import logging
+from scipy.cluster.hierarchy import linkage, fcluster
+from scipy.spatial.distance import squareform
+from scipy.stats import entropy
 
 from .utils import PurgedKFold
-from sklearn.metrics import log_loss, accuracy_score
+from .multiprocess import process_jobs, default_backend, shared_args
+from sklearn.base import clone
+from sklearn.metrics import log_loss, accuracy_score, mutual_info_score
 from sklearn.tree import DecisionTreeClassifier
 from sklearn.ensemble import BaggingClassifier
 
@@ -23,6 +30,15 @@ def feat_importance(
     scoring="accuracy",
     method="MDI",
     min_w_leaf=0.0,
+    num_threads=1,
+    n_repeats=1,
+    backend=None,
+    adaptive=False,
+    tree_batch=100,
+    tol=0.01,
+    clustered=False,
+    cluster_method="corr",
+    cluster_threshold=0.5,
     **kwargs
 ):
     logging.info(f"feat_importance for {len(X.columns)} features")
@@ -41,11 +57,21 @@ def feat_importance(
         max_features=1.0,
         max_samples=max_samples,
         oob_score=True,
+        n_jobs=num_threads,
     )
 
+    # Substitute features share their importance, clustered importance is measured per cluster of them.
+    # SFI scores features on their own, which substitutes don't affect
+    clusters = cluster_features(X, cluster_method, cluster_threshold) if clustered and method != "SFI" else None
+    fit = None
+    if adaptive:
+        # Small train sets don't need all n_estimators trees for their importances to settle
+        fit = grow_ensemble(clf, X, y, tree_batch, tol)
+        clf.set_params(n_estimators=len(fit.estimators_))
+
     if method == "MDI":
-        fit = clf.fit(X=X, y=y)
-        imp = feat_imp_MDI(fit, feat_names=X.columns)
+        fit = clf.fit(X=X, y=y) if fit is None else fit
+        imp = feat_imp_MDI(fit, feat_names=X.columns, clusters=clusters)
     elif method == "MDA":
         sample_weight = pd.Series(1, index=events.index)
         imp = feat_imp_MDA(
@@ -57,19 +83,44 @@ def feat_importance(
             t1=events["t1"],
             pct_embargo=pct_embargo,
             scoring=scoring,
+            n_repeats=n_repeats,
+            num_threads=num_threads,
+            backend=backend,
+            clusters=clusters,
+        )
+    elif method == "SFI":
+        sample_weight = pd.Series(1, index=events.index)
+        imp = feat_imp_SFI(
+            clf=clf,
+            X=X,
+            y=y,
+            cv=cv,
+            sample_weight=sample_weight,
+            t1=events["t1"],
+            pct_embargo=pct_embargo,
+            scoring=scoring,
+            num_threads=num_threads,
+            backend=backend,
         )
+    else:
+        raise ValueError(f"unknown feature importance method {method}")
 
+    if clusters is not None:
+        imp = expand_clusters(imp, clusters)
+    imp["n_estimators"] = clf.n_estimators
     imp = imp.sort_values("mean", ascending=True)
 
     return imp
 
 
-def feat_imp_MDI(fit, feat_names):
-    # feat importance based on IS mean impurity reduction
+def feat_imp_MDI(fit, feat_names, clusters=None):
+    # feat importance based on IS mean impurity reduction, of every feature or every cluster of features
     df0 = {i: tree.feature_importances_ for i, tree in enumerate(fit.estimators_)}
     df0 = pd.DataFrame.from_dict(df0, orient="index")
     df0.columns = feat_names
     df0 = df0.replace(0, np.nan)  # because max_features = 1
+    if clusters is not None:
+        df0 = pd.concat({name: df0[cols].sum(axis=1) for name, cols in clusters.items()}, axis=1)
     imp = pd.concat(
         {"mean": df0.mean(), "std": df0.std() * df0.shape[0] ** -0.5}, axis=1
     )
@@ -77,39 +128,143 @@ def feat_imp_MDI(fit, feat_names):
     return imp
 
 
-def feat_imp_MDA(clf, X, y, cv, sample_weight, t1, pct_embargo, scoring="neg_log_loss"):
-    # feat importance based on OOS score reduction
+def oob_proba_update(fit, X, oob_proba, start=0):
+    """Add the OOB predict_proba of the bagged estimators from start onwards to oob_proba"""
+    estimators = zip(fit.estimators_[start:], fit.estimators_samples_[start:], fit.estimators_features_[start:])
+    for estimator, samples, features in estimators:
+        oob = np.ones(X.shape[0], dtype=bool)
+        oob[samples] = False
+        # Estimators are fit on the encoded labels, the bootstrap of some may have missed a class
+        oob_proba[np.ix_(oob, estimator.classes_.astype(int))] += estimator.predict_proba(X[oob][:, features])
+    return oob_proba
+
+
+def grow_ensemble(clf, X, y, batch=100, tol=0.01):
+    """
+    Fit a bagged ensemble in batches of trees using warm_start, up to clf's n_estimators, until neither
+    its OOB accuracy nor its MDI importances (1 - their correlation) change more than tol after a batch
+    """
+    max_estimators = clf.n_estimators
+    # OOB scores aren't available with warm_start, so we keep track of the OOB probabilities ourselves
+    clf = clone(clf).set_params(warm_start=True, oob_score=False)
+    X_, y_ = X.values, y.values
+    oob_proba, last_score, last_mdi = None, None, None
+    for n_estimators in range(batch, max_estimators + batch, batch):
+        start = len(getattr(clf, "estimators_", []))
+        fit = clf.set_params(n_estimators=min(n_estimators, max_estimators)).fit(X=X_, y=y_)
+        if oob_proba is None:
+            oob_proba = np.zeros((len(y_), len(fit.classes_)))
+        oob_proba_update(fit, X_, oob_proba, start)
+        scored = oob_proba.sum(axis=1) > 0
+        score = accuracy_score(y_[scored], fit.classes_[oob_proba[scored].argmax(axis=1)])
+        mdi = feat_imp_MDI(fit, feat_names=X.columns)["mean"]
+        logging.debug(f"{len(fit.estimators_)} trees: OOB accuracy {score:.4f}")
+        if last_score is not None:
+            # Compared by value rather than rank, features that don't matter keep swapping places
+            mdi_change = 1 - mdi.corr(last_mdi)
+            if abs(score - last_score) < tol and mdi_change < tol:
+                break
+        last_score, last_mdi = score, mdi
+    logging.info(f"Grew {len(fit.estimators_)}/{max_estimators} trees for feature importance")
+    return fit
+
+
+def split_estimators(n_estimators, n_chunks):
+    """Split an ensemble's estimators into at most n_chunks (non-empty) chunks of about equal size"""
+    parts = np.linspace(0, n_estimators, min(n_chunks, n_estimators) + 1).astype(int)
+    return np.diff(parts)
+
+
+def permutation(seed, column, repeat, n):
+    # The same for every job of a fold, so that the chunks of its ensemble see the same permutations
+    return np.random.RandomState((seed + 1009 * column + repeat) % 2 ** 32).permutation(n)
+
+
+def mda_job(clf, X, y, sample_weight, train, test, n_repeats, seed, groups):
+    """
+    Fit clf on the train rows, return its classes and its predict_proba (times its number of estimators)
+    on the test rows, first as is and then with every group of columns permuted n_repeats times. Columns
+    are permuted in place in a single copy of the test rows.
+    """
+    fit = clf.fit(X=X[train], y=y[train], sample_weight=sample_weight[train])
+    X1 = np.array(X[test])
+    probas = [fit.predict_proba(X1)]
+    for group in groups:
+        columns = X1[:, group].copy()
+        for r in range(n_repeats):
+            for k, j in enumerate(group):
+                X1[:, j] = columns[permutation(seed, j, r, len(columns)), k]
+            probas.append(fit.predict_proba(X1))
+        X1[:, group] = columns
+    return fit.classes_, np.stack(probas) * clf.n_estimators
+
+
+def mda_score(y1, prob, w1, classes, scoring):
+    if scoring == "neg_log_loss":
+        return -log_loss(y1, prob, sample_weight=w1, labels=classes)
+    return accuracy_score(y1, classes[prob.argmax(axis=1)], sample_weight=w1)
+
+
+def feat_imp_MDA(
+    clf,
+    X,
+    y,
+    cv,
+    sample_weight,
+    t1,
+    pct_embargo,
+    scoring="neg_log_loss",
+    n_repeats=1,
+    num_threads=1,
+    backend=None,
+    random_state=None,
+    clusters=None,
+):
+    """
+    Feature importance based on OOS score reduction, averaged over n_repeats permutations per feature.
+    The folds' bagged ensembles are split into chunks of trees that are fit and scored as separate
+    jobs, the ensemble's probabilities being the average of its trees' probabilities. So a fold uses
+    as many of the num_threads cores as it gets chunks.
+    With clusters ({name: [columns]}) all columns of a cluster are permuted together, giving the
+    importance of every cluster.
+    """
     if scoring not in ["neg_log_loss", "accuracy"]:
         raise ValueError("wrong scoring method")
-    from sklearn.metrics import log_loss, accuracy_score
-    logging.debug(f"MDA with {cv}-fold CV")
+    if backend is None:
+        backend = default_backend(num_threads)
+    logging.debug(f"MDA with {cv}-fold CV, {n_repeats} permutations per feature on {num_threads} threads")
 
     cv_gen = PurgedKFold(n_splits=cv, t1=t1, pct_embargo=pct_embargo)
-    scr0, scr1 = pd.Series(), pd.DataFrame(columns=X.columns)
-    for i, (train, test) in enumerate(cv_gen.split(X=X)):
-        X0, y0, w0 = X.iloc[train, :], y.iloc[train], sample_weight.iloc[train]
-        X1, y1, w1 = X.iloc[test, :], y.iloc[test], sample_weight.iloc[test]
-        fit = clf.fit(X=X0, y=y0, sample_weight=w0.values)
-        if scoring == "neg_log_loss":
-            prob = fit.predict_proba(X1)
-            scr0.loc[i] = -log_loss(
-                y1, prob, sample_weight=w1.values, labels=clf.classes_
-            )
-        else:
-            pred = fit.predict(X1)
-            scr0.loc[i] = accuracy_score(y1, pred, sample_weight=w1.values)
-
-        for j in X.columns:
-            X1_ = X1.copy(deep=True)
-            np.random.shuffle(X1_[j].values)  # permutation of a single column
-            if scoring == "neg_log_loss":
-                prob = fit.predict_proba(X1_)
-                scr1.loc[i, j] = -log_loss(
-                    y1, prob, sample_weight=w1.values, labels=clf.classes_
+    folds = list(cv_gen.split(X=X))
+    chunks = split_estimators(clf.n_estimators, -(-num_threads // len(folds)))
+    rng = np.random.RandomState(random_state)
+    seed = rng.randint(2 ** 31)
+    if clusters is None:
+        clusters = {col: [col] for col in X.columns}
+    groups = [[X.columns.get_loc(x) for x in cols] for cols in clusters.values()]
+
+    data = {"X": X.values, "y": y.values, "sample_weight": sample_weight.values}
+    with shared_args(data, backend, "feat_imp_MDA_") as args:
+        jobs = []
+        for i, (train, test) in enumerate(folds):
+            for n_estimators in chunks:
+                chunk_clf = clone(clf).set_params(
+                    n_estimators=int(n_estimators), oob_score=False, n_jobs=1, random_state=rng.randint(2 ** 31)
                 )
-            else:
-                pred = fit.predict(X1_)
-                scr1.loc[i, j] = accuracy_score(y1, pred, sample_weight=w1.values)
+                jobs.append(dict(func=mda_job, clf=chunk_clf, train=train, test=test, n_repeats=n_repeats,
+                                 seed=seed + i, groups=groups, **args))
+        out = process_jobs(jobs, task="feat_imp_MDA", num_threads=num_threads, backend=backend)
+
+    scr0, scr1 = pd.Series(dtype=np.float64), pd.DataFrame(columns=list(clusters), dtype=np.float64)
+    for i, (train, test) in enumerate(folds):
+        fold_out = out[i * len(chunks): (i + 1) * len(chunks)]
+        classes = fold_out[0][0]
+        probas = sum(x[1] for x in fold_out) / clf.n_estimators
+        y1, w1 = y.values[test], sample_weight.values[test]
+        scr0.loc[i] = mda_score(y1, probas[0], w1, classes, scoring)
+        for j, name in enumerate(clusters):
+            scores = [mda_score(y1, probas[1 + j * n_repeats + r], w1, classes, scoring) for r in range(n_repeats)]
+            scr1.loc[i, name] = np.mean(scores)
 
     imp = (-scr1).add(scr0, axis=0)
     if scoring == "neg_log_loss":
@@ -120,4 +275,114 @@ def feat_imp_MDA(clf, X, y, cv, sample_weight, t1, pct_embargo, scoring="neg_log
     imp = pd.concat(
         {"mean": imp.mean(), "std": imp.std() * imp.shape[0] ** -0.5}, axis=1
     )
-    return imp
\ No newline at end of file
+    return imp
+
+
+
+def sfi_job(clf, X, y, sample_weight, folds, column, scoring):
+    """Purged CV scores of clf on a single column"""
+    X_ = X[:, [column]]
+    scores = []
+    for train, test in folds:
+        fit = clf.fit(X=X_[train], y=y[train], sample_weight=sample_weight[train])
+        prob = fit.predict_proba(X_[test])
+        scores.append(mda_score(y[test], prob, sample_weight[test], fit.classes_, scoring))
+    return scores
+
+
+def feat_imp_SFI(
+    clf,
+    X,
+    y,
+    cv,
+    sample_weight,
+    t1,
+    pct_embargo,
+    scoring="neg_log_loss",
+    num_threads=1,
+    backend=None,
+    random_state=None,
+):
+    """
+    Single feature importance, the OOS score of every feature on its own. Free of substitution effects,
+    but blind to features that only matter jointly. Every feature is a job.
+    """
+    if scoring not in ["neg_log_loss", "accuracy"]:
+        raise ValueError("wrong scoring method")
+    if backend is None:
+        backend = default_backend(num_threads)
+    logging.debug(f"SFI with {cv}-fold CV on {num_threads} threads")
+
+    folds = list(PurgedKFold(n_splits=cv, t1=t1, pct_embargo=pct_embargo).split(X=X))
+    rng = np.random.RandomState(random_state)
+    data = {"X": X.values, "y": y.values, "sample_weight": sample_weight.values}
+    with shared_args(data, backend, "feat_imp_SFI_") as args:
+        jobs = [
+            dict(func=sfi_job, clf=clone(clf).set_params(oob_score=False, n_jobs=1, random_state=rng.randint(2 ** 31)),
+                 folds=folds, column=j, scoring=scoring, **args)
+            for j in range(X.shape[1])
+        ]
+        out = process_jobs(jobs, task="feat_imp_SFI", num_threads=num_threads, backend=backend)
+
+    scores = pd.DataFrame(out, index=X.columns)
+    imp = pd.concat(
+        {"mean": scores.mean(axis=1), "std": scores.std(axis=1) * scores.shape[1] ** -0.5}, axis=1
+    )
+    return imp
+
+
+# Cell
+# Clustered feature importance: features that substitute for one another (e.g. the same measure over
+# neighbouring windows) dilute each other's importance, so features are clustered by a distance and
+# MDI/MDA are measured per cluster.
+
+
+def corr_distance(X):
+    """Distance between features from their absolute correlation, sqrt(1 - |rho|)"""
+    return np.sqrt((1 - X.corr().abs()).clip(lower=0)).fillna(1.0)
+
+
+def var_info_distance(X, bins=None):
+    """Variation of information between features over their joint entropy, a mutual information based distance"""
+    values = X.dropna().values
+    bins = bins or max(2, int(round(np.sqrt(values.shape[0] / 5))))
+    h = [entropy(np.histogram(values[:, i], bins)[0]) for i in range(values.shape[1])]
+    dist = np.zeros((values.shape[1], values.shape[1]))
+    for i in range(values.shape[1]):
+        for j in range(i + 1, values.shape[1]):
+            joint = np.histogram2d(values[:, i], values[:, j], bins)[0]
+            mi = mutual_info_score(None, None, contingency=joint)
+            h_ij = h[i] + h[j] - mi
+            dist[i, j] = dist[j, i] = (h_ij - mi) / h_ij if h_ij > 0 else 0.0
+    return pd.DataFrame(dist, index=X.columns, columns=X.columns)
+
+
+CLUSTER_DISTANCES = {"corr": corr_distance, "vi": var_info_distance}
+
+
+def cluster_features(X, method="corr", threshold=0.5):
+    """Cluster features hierarchically (average linkage) by the distance `method`, returns {name: [columns]}"""
+    if X.shape[1] < 2:
+        return {"C_0": list(X.columns)}
+    dist = CLUSTER_DISTANCES[method](X)
+    labels = fcluster(linkage(squareform(dist.values, checks=False), method="average"), threshold, "distance")
+    clusters = {}
+    for col, label in zip(X.columns, labels):
+        clusters.setdefault(f"C_{label - 1}", []).append(col)
+    logging.debug(f"Clustered {X.shape[1]} features into {len(clusters)} clusters: {clusters}")
+    return clusters
+
+
+def expand_clusters(imp, clusters):
+    """Per feature importances from per cluster ones, every feature getting its cluster's"""
+    cluster_of = pd.Series({col: name for name, cols in clusters.items() for col in cols})
+    out = imp.reindex(cluster_of.values)
+    out.index = cluster_of.index
+    out["cluster"] = cluster_of.values
+    return out
+
+
+def cluster_representatives(X, clusters):
+    """The member of every cluster with the highest mean absolute correlation to the rest of it"""
+    corr = X.corr().abs().fillna(0)
+    return [corr.loc[cols, cols].mean(axis=1).idxmax() for cols in clusters.values()]
@@ -1,22 +1,48 @@
-__all__ = ['cusum']
+__all__ = ['cusum_kernel', 'cusum']
 
 # Cell
+import numpy as np
 import pandas as pd
 
+try:
+    from numba import njit
+except ImportError:  # numba is optional, without it the kernel runs as plain python over the arrays
+    njit = None
+
+
+def cusum_kernel(diff, h):
+    """Flag the positions at which the symmetric CUSUM filter on `diff` exceeds the thresholds `h`"""
+    events = np.zeros(diff.shape[0], dtype=np.bool_)
+    s_pos, s_neg = 0.0, 0.0
+    for i in range(1, diff.shape[0]):
+        # Written out instead of max/min to keep python's NaN behaviour (a NaN resets the sums)
+        s_pos = s_pos + diff[i]
+        s_pos = s_pos if s_pos > 0.0 else 0.0
+        s_neg = s_neg + diff[i]
+        s_neg = s_neg if s_neg < 0.0 else 0.0
+        if s_neg < -h[i]:
+            s_neg = 0.0
+            events[i] = True
+        elif s_pos > h[i]:
+            s_pos = 0.0
+            events[i] = True
+    return events
+
+
+if njit is not None:
+    cusum_kernel = njit(cache=True)(cusum_kernel)
+
 
 def cusum(g_raw, h):
     """
     The CUSUM filter is a quality-control method, designed to detect a shift in the mean value of
     a measured quantity away from a target value.
+    h is either a constant threshold or a series of thresholds, which gets aligned to g_raw's index
     """
-    t_events, s_pos, s_neg = [], 0, 0
-    diff = g_raw.diff()
-    for i in diff.index[1:]:
-        s_pos, s_neg = max(0, s_pos + diff.loc[i]), min(0, s_neg + diff.loc[i])
-        if s_neg < -h:
-            s_neg = 0
-            t_events.append(i)
-        elif s_neg > h:
-            s_pos = 0
-            t_events.append(i)
-    return pd.DatetimeIndex(t_events)
\ No newline at end of file
+    if isinstance(h, pd.Series):
+        h = h.reindex(g_raw.index).values.astype(np.float64)
+    else:
+        h = np.full(g_raw.shape[0], h, dtype=np.float64)
+    diff = g_raw.diff().values.astype(np.float64)
+    events = cusum_kernel(diff, h)
+    return pd.DatetimeIndex(g_raw.index[events])
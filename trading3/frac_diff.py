@@ -3,8 +3,10 @@ __all__ = ['get_weights_ffd', 'frac_diff_ffd']
 # Cell
 import numpy as np
 import pandas as pd
+from functools import lru_cache
 
 
+@lru_cache(maxsize=None)
 def get_weights_ffd(d, thres):
     w, k = [1.0], 1
     while True:
@@ -13,7 +15,9 @@ def get_weights_ffd(d, thres):
             break
         w.append(w_)
         k += 1
-    return np.array(w[::-1]).reshape(-1, 1)
+    w = np.array(w[::-1]).reshape(-1, 1)
+    w.setflags(write=False)  # shared by every caller through the cache
+    return w
 
 
 def frac_diff_ffd(series, d, thres=1e-5):
@@ -22,15 +26,16 @@ def frac_diff_ffd(series, d, thres=1e-5):
     width, df = len(w) - 1, {}
 
     for name in series.columns:
-        series_f, df_ = (
-            series[[name]].fillna(method="ffill").dropna(),
-            pd.Series(index=series.index),
+        series_f = series[name].ffill().dropna()
+        if series_f.shape[0] <= width:
+            df[name] = pd.Series(np.nan, index=series.index)  # not enough history for a single window
+            continue
+        # Every row's dot product with the weights over the last width + 1 rows is one convolution
+        df_ = pd.Series(
+            np.convolve(series_f.values, w[::-1, 0], mode="valid"),
+            index=series_f.index[width:],
         )
-        for iloc1 in range(width, series_f.shape[0]):
-            loc0, loc1 = series_f.index[iloc1 - width], series_f.index[iloc1]
-            if not np.isfinite(series.loc[loc1, name]):
-                continue  # exclude NAs
-            df_[loc1] = np.dot(w.T, series_f.loc[loc0:loc1])[0, 0]
-        df[name] = df_.copy(deep=True)
+        df_ = df_[np.isfinite(series[name].reindex(df_.index).values)]  # exclude NAs
+        df[name] = df_.reindex(series.index)
     df = pd.concat(df, axis=1)
-    return df
\ No newline at end of file
+    return df
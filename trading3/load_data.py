@@ -1,27 +1,52 @@
 
-__all__ = ['DATA_DIR', 'F_PAYLOAD_DIR', 'DAILY_DATA_DIR', 'SYMBOLS_CSV', 'get_symbols', 'load_contract',
-           'load_contracts', 'load_all_cont_contracts', 'get_data', 'process_bars', 'load_and_sample_bars',
-           'determine_bar_size', 'feat_safe_name', 'load_hdf', 'save_hdf', 'bars_path', 'events_b_path', 'feats_path',
-           'feat_path', 'imp_path', 'payload_path', 'load_bars', 'save_bars', 'load_events_b', 'save_events_b',
-           'load_feat', 'save_feat', 'load_imp', 'save_imp', 'load_payload', 'save_payload']
+__all__ = ['DATA_DIR', 'F_PAYLOAD_DIR', 'DAILY_DATA_DIR', 'CONTRACT_CACHE_DIR', 'SYMBOLS_CSV', 'get_symbols',
+           'contract_csv_path', 'contract_cache_path', 'parse_contract_csv', 'to_columnar', 'from_columnar', 'to_ns',
+           'columnar_row_range', 'load_contract_cache', 'save_contract_cache', 'load_columnar', 'load_contract',
+           'contract_manifest_path', 'load_contract_manifest', 'save_contract_manifest', 'index_contracts',
+           'load_contracts', 'load_all_cont_contracts', 'get_data', 'DATA_CACHE_BYTES', 'cache_data', 'get_cached_data',
+           'clear_data_cache', 'process_bars', 'load_and_sample_bars', 'determine_bar_size', 'feat_safe_name',
+           'load_hdf', 'save_hdf', 'bars_path', 'events_b_path', 'feats_path', 'feat_store_path', 'feat_store_symbol',
+           'imp_path', 'payload_path', 'load_bars', 'save_bars', 'load_events_b', 'save_events_b', 'date_range_where',
+           'file_lock', 'feat_store_lengths', 'feat_store_timestamp', 'load_feat_store', 'write_feat_store',
+           'save_feat_store', 'load_feats', 'save_feats', 'load_imp', 'save_imp', 'load_payload', 'save_payload',
+           'trials_path', 'connect_trials', 'load_trials', 'load_best_trials', 'save_trials']
 
 # Cell
 
 import seaborn as sn
 import pandas as pd
+import hashlib
 import json
 import logging
+import os
+import shutil
+import sqlite3
+import time
+import threading
+import warnings
+from collections import OrderedDict
+from contextlib import contextmanager
 from path import Path
+from tables import NaturalNameWarning
 from dateutil.relativedelta import relativedelta
 from mlfinlab.data_structures import get_dollar_bars, get_tick_bars, get_volume_bars
 
 from .utils import NumpyEncoder
 
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
 # You'll likely have to change these if you're intending to run the code yourself
 # TODO: Factor out into settings.py file
 DATA_DIR = Path("~/Dropbox/algotrading/data").expanduser()
 F_PAYLOAD_DIR = Path("~/pr/fincl/frontend/public/payloads").expanduser()
 DAILY_DATA_DIR = DATA_DIR / "daily"
+# Sub-directory of every data directory holding the typed copies of its contract CSVs
+CONTRACT_CACHE_DIR = "cache"
 
 SYMBOLS_CSV = pd.read_csv(DATA_DIR / "symbols.csv", index_col="iqsymbol")
 
@@ -48,10 +73,16 @@ def get_symbols(symbol_groups):
     return [x for x in picked.index.values if x not in ignore]
 
 
-def load_contract(contract_name, directory):
-    series = pd.read_csv(
-        DATA_DIR / directory / "{}.csv".format(contract_name), index_col=0
-    )
+def contract_csv_path(contract_name, directory):
+    return DATA_DIR / directory / "{}.csv".format(contract_name)
+
+
+def contract_cache_path(contract_name, directory):
+    return DATA_DIR / directory / CONTRACT_CACHE_DIR / "{}.h5".format(contract_name)
+
+
+def parse_contract_csv(contract_name, directory):
+    series = pd.read_csv(contract_csv_path(contract_name, directory), index_col=0)
     series = series[::-1]
     if directory == "minutely":
         series["Time"] = series["date"] + " " + series["time"]
@@ -66,26 +97,171 @@ def load_contract(contract_name, directory):
     series = series.rename(
         columns={"close_p": "Close", "open_p": "Open", "prd_vlm": "Volume"}
     )
+    return series
+
+
+def to_columnar(series):
+    # Typed layout of a contract on disk: int64 nanosecond timestamps and float64 prices/volumes
+    return pd.DataFrame(
+        {
+            "Time": series.index.values.astype("datetime64[ns]").astype("int64"),
+            "Open": series["Open"].values.astype("float64"),
+            "Close": series["Close"].values.astype("float64"),
+            "Volume": series["Volume"].values.astype("float64"),
+        },
+        columns=["Time", "Open", "Close", "Volume"],
+    )
+
+
+def from_columnar(columnar):
+    index = pd.DatetimeIndex(pd.to_datetime(columnar["Time"].values, unit="ns"), name="Time")
+    series = pd.DataFrame(
+        {
+            "Open": columnar["Open"].values,
+            "Close": columnar["Close"].values,
+            "Volume": columnar["Volume"].values,
+            "Time": index,
+        },
+        index=index,
+        columns=["Open", "Close", "Volume", "Time"],
+    )
+    return series
+
+
+def to_ns(date):
+    return None if date is None else pd.Timestamp(date).value
+
+
+def columnar_row_range(columnar, start=None, end=None):
+    # Rows are sorted by time, so a [start, end] window is one contiguous row range
+    times = columnar["Time"].values
+    lo = 0 if start is None else times.searchsorted(start, side="left")
+    hi = len(times) if end is None else times.searchsorted(end, side="right")
+    return lo, hi
+
+
+def load_contract_cache(contract_name, directory, src_mtime, start=None, end=None):
+    """Read a contract's columnar cache, None if it is missing or older than its CSV"""
+    path = contract_cache_path(contract_name, directory)
+    if not path.exists():
+        return None
+    with pd.HDFStore(path, mode="r") as store:
+        if getattr(store.get_storer("table").attrs, "src_mtime", None) != src_mtime:
+            return None
+        if start is None and end is None:
+            return store.select("table")
+        lo, hi = columnar_row_range(store.select("table", columns=["Time"]), start, end)
+        return store.select("table", start=lo, stop=hi)
+
+
+def save_contract_cache(columnar, contract_name, directory, src_mtime):
+    path = contract_cache_path(contract_name, directory)
+    path.dirname().makedirs_p()
+    # Write next to the target and swap it in so concurrent runs never see a half-written file
+    tmp_path = Path(f"{path}.{os.getpid()}.tmp")
+    with pd.HDFStore(tmp_path, mode="w", complevel=5, complib="blosc") as store:
+        store.put("table", columnar, format="table")
+        store.get_storer("table").attrs.src_mtime = src_mtime
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_columnar(contract_name, directory, start_date=None, end_date=None):
+    # Parsing the CSVs' date strings is slow, so we keep a typed copy of every contract around
+    # and only re-parse a CSV when its mtime differs from the one the cache was built from
+    src_mtime = contract_csv_path(contract_name, directory).mtime
+    start, end = to_ns(start_date), to_ns(end_date)
+    columnar = load_contract_cache(contract_name, directory, src_mtime, start, end)
+    if columnar is None:
+        columnar = to_columnar(parse_contract_csv(contract_name, directory))
+        save_contract_cache(columnar, contract_name, directory, src_mtime)
+        lo, hi = columnar_row_range(columnar, start, end)
+        columnar = columnar.iloc[lo:hi]
+    return columnar
+
+
+def load_contract(contract_name, directory, start_date=None, end_date=None):
+    series = from_columnar(load_columnar(contract_name, directory, start_date, end_date))
     series["Instrument"] = contract_name
     return series
 
 
+def contract_manifest_path(directory):
+    return DATA_DIR / directory / CONTRACT_CACHE_DIR / "manifest.json"
+
+
+def load_contract_manifest(directory):
+    path = contract_manifest_path(directory)
+    if not path.exists():
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except ValueError:
+        logging.error(f"corrupted contract manifest: {path}")
+        return {}
+
+
+def save_contract_manifest(directory, manifest):
+    path = contract_manifest_path(directory)
+    path.dirname().makedirs_p()
+    tmp_path = Path(f"{path}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, sort_keys=True)
+    os.replace(tmp_path, path)
+    return path
+
+
+def index_contracts(contract_names, directory):
+    """First & last timestamp (in ns) and row count of every contract, refreshing stale manifest entries"""
+    manifest, refreshed = load_contract_manifest(directory), {}
+    for name in contract_names:
+        src_mtime = contract_csv_path(name, directory).mtime
+        entry = manifest.get(name)
+        if entry is None or entry["src_mtime"] != src_mtime:
+            times = load_columnar(name, directory)["Time"].values
+            refreshed[name] = {
+                "src_mtime": src_mtime,
+                "first": int(times[0]) if len(times) else None,
+                "last": int(times[-1]) if len(times) else None,
+                "rows": len(times),
+            }
+    if refreshed:
+        # Workers loading other symbols share the manifest, merge into the latest one so no entries get lost
+        path = contract_manifest_path(directory)
+        path.dirname().makedirs_p()
+        with file_lock(path, exclusive=True):
+            manifest = {**load_contract_manifest(directory), **refreshed}
+            save_contract_manifest(directory, manifest)
+    return {name: manifest[name] for name in contract_names}
+
+
 def load_contracts(symbol, directory="minutely", start_date=None, end_date=None):
     contract_names = [
         x.basename().namebase
         for x in (DATA_DIR / directory).files("*{}*".format(symbol))
     ]
-    loaded = [load_contract(x, directory) for x in contract_names]
-    loaded = list(sorted(loaded, key=lambda x: x.index[-1]))
-    first = loaded[0]
-    # cut out from later contracts what former contracts already have
-    zipped = zip(loaded, loaded[1:])
-    cut_contracts = [
-        latter.truncate(before=former.index[-1] + pd.Timedelta(minutes=1))
-        for former, latter in zipped
-    ]
-
-    concatted = pd.concat([first] + cut_contracts)
+    manifest = index_contracts(contract_names, directory)
+    contract_names = [x for x in contract_names if manifest[x]["rows"]]
+    contract_names = list(sorted(contract_names, key=lambda x: manifest[x]["last"]))
+
+    # cut out from later contracts what former contracts already have. Using the manifest we know
+    # which slice every contract contributes up front and only read the ones overlapping our window
+    start, end = to_ns(start_date), to_ns(end_date)
+    roll_gap = pd.Timedelta(minutes=1).value
+    contributes_from = [None] + [manifest[x]["last"] + roll_gap for x in contract_names[:-1]]
+    cut_contracts = []
+    for name, lo in zip(contract_names, contributes_from):
+        lo = max(x for x in [lo, start, manifest[name]["first"]] if x is not None)
+        hi = manifest[name]["last"] if end is None else min(end, manifest[name]["last"])
+        if lo > hi:
+            continue
+        cut_contracts.append(load_contract(name, directory, pd.Timestamp(lo), pd.Timestamp(hi)))
+
+    if not cut_contracts:
+        return load_contract(contract_names[-1], directory, start_date, end_date).iloc[:0]
+
+    concatted = pd.concat(cut_contracts)
     return concatted.truncate(before=start_date, after=end_date)
 
 
@@ -105,6 +281,43 @@ def get_data(symbol, frequency, start_date, end_date):
         end_date,
     )
 
+
+# Series external to the trading universe (e.g. VIX.XO) are used by the features of every symbol, so they're
+# kept around, evicting the least recently used ones once they take up more than DATA_CACHE_BYTES
+DATA_CACHE_BYTES = 2 * 1024 ** 3
+_DATA_CACHE = OrderedDict()
+_DATA_CACHE_LOCK = threading.Lock()
+
+
+def cache_data(key, data, max_bytes=None):
+    max_bytes = DATA_CACHE_BYTES if max_bytes is None else max_bytes
+    nbytes = int(data.memory_usage(index=True, deep=True).sum())
+    if nbytes > max_bytes:
+        return data
+    with _DATA_CACHE_LOCK:
+        _DATA_CACHE[key] = (data, nbytes)
+        _DATA_CACHE.move_to_end(key)
+        while sum(x[1] for x in _DATA_CACHE.values()) > max_bytes:
+            evicted, _ = _DATA_CACHE.popitem(last=False)
+            logging.debug(f"Evicted {evicted} from the data cache")
+    return data
+
+
+def get_cached_data(symbol, frequency, start_date, end_date, max_bytes=None):
+    """get_data through a process-wide LRU cache. The frames are shared, callers mustn't modify them"""
+    key = (symbol, frequency, start_date, end_date)
+    with _DATA_CACHE_LOCK:
+        if key in _DATA_CACHE:
+            _DATA_CACHE.move_to_end(key)
+            return _DATA_CACHE[key][0]
+    return cache_data(key, get_data(symbol, frequency, start_date, end_date), max_bytes)
+
+
+def clear_data_cache():
+    with _DATA_CACHE_LOCK:
+        _DATA_CACHE.clear()
+
+
 def process_bars(bars, size, fun):
     # Renaming our bar columns & format for mlfinlab for processing and then back into our original format
     # OHL from 1-min bars are ignored
@@ -171,16 +384,26 @@ def feats_path(symbol, c):
     return DATA_DIR / c['bar_type'] / f"{symbol}_feats_{feat_names}.h5"
 
 
-def feat_path(c, feat_c):
-    # Make a compact, unique path for this feature config
-    basename = feat_safe_name(feat_c)
-    return DATA_DIR / 'features' / c['bar_type'] / f"{basename}.h5"
+def feat_store_path(symbol, c):
+    # All features computed on a symbol's data live as columns of a single table
+    return DATA_DIR / 'features' / c['bar_type'] / f"{symbol}_features.h5"
+
+
+def feat_store_symbol(feat_c, for_symbol):
+    # Features on features are stored with the symbol whose data they're ultimately computed on
+    symbol = feat_c.get('symbol', for_symbol)
+    return feat_store_symbol(symbol, for_symbol) if isinstance(symbol, dict) else symbol
 
 
 def imp_path(symbol, c):
-    # TODO: This ignores feature paramters
     feat_names = '-'.join(sorted(set(x['name'] for x in c['features'])))
-    return DATA_DIR / c['bar_type'] / f"{symbol}_fimp_{c['binarize']}_{c['binarize_params']}_{c['alpha']}_{c['alpha_params']}_{feat_names}_{c['feat_imp_method']}.h5"
+    # Feature parameters are too long for a file name, they go in as a digest
+    feat_params = hashlib.sha1(json.dumps(sorted(feat_safe_name(x) for x in c['features'])).encode()).hexdigest()[:10]
+    # Importances of clusters depend on how the features were clustered
+    clustered = f"_clustered_{c['feat_cluster_method']}_{c['feat_cluster_threshold']}" if c['feat_imp_clustered'] else ''
+    adaptive = f"_adaptive_{c['feat_imp_tol']}" if c['feat_imp_adaptive'] else ''
+    method = f"{c['feat_imp_method']}_cv{c['feat_imp_cv']}_n{c['feat_imp_n_estimators']}_r{c['feat_imp_repeats']}{adaptive}"
+    return DATA_DIR / c['bar_type'] / f"{symbol}_fimp_{c['binarize']}_{c['binarize_params']}_{c['alpha']}_{c['alpha_params']}_{feat_names}_{feat_params}_{method}{clustered}.h5"
 
 
 def payload_path(symbols, c):
@@ -214,16 +437,183 @@ def save_events_b(symbol, config, events_b):
         return save_hdf(events_b, path)
 
 
-def load_feat(config, feat_config):
-    if config["load_from_disk"]:
-        path = feat_path(config, feat_config)
-        return load_hdf(path)
+def date_range_where(start_date=None, end_date=None):
+    where = []
+    if start_date is not None:
+        where.append(f"index >= {pd.Timestamp(start_date)!r}")
+    if end_date is not None:
+        where.append(f"index <= {pd.Timestamp(end_date)!r}")
+    return " & ".join(where) or None
+
+
+@contextmanager
+def file_lock(path, exclusive=False):
+    """
+    Lock a file through a sibling .lock file. Several configs, possibly running at the same time,
+    share a symbol's feature store, so its writes hold an exclusive lock around their read-modify-write.
+    Windows has no shared locks, there readers lock exclusively too
+    """
+    with open(f"{path}.lock", "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    # Gives up with an OSError after 10 attempts a second apart
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def feat_store_lengths(store):
+    """
+    Number of rows every column of a feature store has values for. Rows are appended for the columns
+    being updated, so the others are left behind with NaNs in the new rows until they're updated
+    """
+    storer = store.get_storer("table")
+    lengths = {x: storer.nrows for x in storer.non_index_axes[0][1]}
+    lengths.update(getattr(storer.attrs, "feat_lengths", None) or {})
+    return lengths
+
+
+def feat_store_timestamp(store, position):
+    return store.select_column("table", "index", start=position, stop=position + 1).iloc[0]
+
+
+def load_feat_store(symbol, config, columns=None, start_date=None, end_date=None):
+    """
+    Read the `columns` we have of a symbol's feature store, optionally only the rows in a date range.
+    Returns them with the last timestamp every column has values for, or None
+    """
+    path = feat_store_path(symbol, config)
+    if not path.exists():
+        return None
+    with file_lock(path), pd.HDFStore(path, mode="r") as store:
+        lengths = feat_store_lengths(store)
+        columns = list(lengths) if columns is None else [x for x in columns if x in lengths]
+        columns = [x for x in columns if lengths[x]]
+        if not columns:
+            return None
+        ends = {x: feat_store_timestamp(store, lengths[x] - 1) for x in columns}
+        return store.select("table", where=date_range_where(start_date, end_date), columns=columns), ends
+
+
+def write_feat_store(path, feats, lengths):
+    # Write next to the target and swap it in so concurrent runs never see a half-written file.
+    # Every feature is a column of its own, so that it can be updated in place. Without PyTables indexes
+    # on them, which every update would have to rebuild in full
+    tmp_path = Path(f"{path}.{os.getpid()}.tmp")
+    with pd.HDFStore(tmp_path, mode="w", complevel=5, complib="blosc") as store:
+        store.put("table", feats, format="table", data_columns=True, index=False)
+        store.get_storer("table").attrs.feat_lengths = lengths
+    os.replace(tmp_path, path)
+
+
+def save_feat_store(symbol, config, feats, resumed=()):
+    """
+    Add the columns of `feats` to a symbol's feature store, replacing the ones it already has.
+    Columns in `resumed` were computed from where their stored values end, of those only the new values get
+    written: when the bars only got new rows and all columns are resumed, the new rows are appended and the
+    columns' new values written in place on a copy of the store, otherwise the store is rewritten.
+    Stored columns are only dropped when the rows they're on changed.
+    """
+    path = feat_store_path(symbol, config)
+    path.dirname().makedirs_p()
+    with file_lock(path, exclusive=True), warnings.catch_warnings():
+        # Feature names aren't Python identifiers, which PyTables warns about for every column of every write
+        warnings.simplefilter("ignore", NaturalNameWarning)
+        if not path.exists():
+            write_feat_store(path, feats, {x: len(feats) for x in feats.columns})
+            return path
+
+        with pd.HDFStore(path, mode="r") as store:
+            storer = store.get_storer("table")
+            n, lengths = storer.nrows, feat_store_lengths(store)
+            m = min(n, len(feats))
+            # One index is the start of the other if they agree on their common first and last rows
+            same_rows = m == 0 or (
+                feat_store_timestamp(store, 0) == feats.index[0]
+                and feat_store_timestamp(store, m - 1) == feats.index[m - 1]
+            )
+            in_place = same_rows and set(feats.columns) <= set(resumed) & set(storer.data_columns or [])
+            stored = None if in_place else store.select("table")
+
+        if in_place:
+            # Updated on a copy that's swapped in, so that a write dying halfway leaves the store as it was
+            tmp_path = Path(f"{path}.{os.getpid()}.tmp")
+            shutil.copyfile(path, tmp_path)
+            with pd.HDFStore(tmp_path, mode="a") as store:
+                if len(feats) > n:
+                    # The new rows of the columns not given here stay NaN until those get updated
+                    store.append("table", feats.iloc[n:].reindex(columns=list(lengths)), data_columns=True, index=False)
+                table = store.get_storer("table").table
+                for column in feats.columns:
+                    start, stop = lengths[column], min(n, len(feats))
+                    if start < stop:
+                        table.modify_column(start=start, stop=stop, column=feats[column].values[start:stop],
+                                            colname=column)
+                    lengths[column] = max(lengths[column], len(feats))
+                store.get_storer("table").attrs.feat_lengths = lengths
+            os.replace(tmp_path, path)
+            return path
+
+        # Recomputed or new columns, or a store without a column per feature: rewrite it on the longer of the
+        # two indexes, which is much faster than replacing whole columns in place
+        if same_rows:
+            index = feats.index if len(feats) > n else stored.index
+            keep = [x for x in stored.columns if x not in feats.columns]
+            lengths = {**{x: lengths[x] for x in keep}, **{x: len(feats) for x in feats.columns}}
+            feats = pd.concat([stored[keep].reindex(index), feats.reindex(index)], axis=1)
+        else:
+            # The bars changed since the store was written, so what's in it no longer lines up
+            logging.warning(f"{path}: bars changed, dropping {len(stored.columns)} stored features")
+            lengths = {x: len(feats) for x in feats.columns}
+        write_feat_store(path, feats, lengths)
+    return path
 
 
-def save_feat(config, feat_config, feat):
-    if config["save_to_disk"]:
-        path = feat_path(config, feat_config)
-        return save_hdf(feat, path)
+def load_feats(config, for_symbol, feat_configs, start_date=None, end_date=None):
+    """Load features from their symbols' stores, reading every store once. None for the ones we don't have"""
+    if not config["load_from_disk"]:
+        return [None] * len(feat_configs)
+    names = [feat_safe_name(x) for x in feat_configs]
+    symbols = [feat_store_symbol(x, for_symbol) for x in feat_configs]
+    stores = {
+        symbol: load_feat_store(symbol, config, [n for n, s in zip(names, symbols) if s == symbol],
+                                start_date, end_date)
+        for symbol in set(symbols)
+    }
+    # Every feature's column is called Close to enable easy recursion. Columns end where their values do,
+    # so features left behind by other configs' updates come back shorter than their bars
+    return [
+        stores[symbol][0].loc[: stores[symbol][1][name], [name]].rename(columns={name: "Close"})
+        if stores[symbol] is not None and name in stores[symbol][1] else None
+        for name, symbol in zip(names, symbols)
+    ]
+
+
+def save_feats(config, for_symbol, feat_configs, feats, resumed=()):
+    """
+    Save features to their symbols' stores, writing every store once. `resumed` are the positions of the
+    features that were computed from where their stored values end, only their new values get written
+    """
+    if not config["save_to_disk"] or not feats:
+        return
+    by_symbol, resumed_names = {}, {feat_safe_name(feat_configs[i]) for i in resumed}
+    for feat_config, feat in zip(feat_configs, feats):
+        symbol = feat_store_symbol(feat_config, for_symbol)
+        by_symbol.setdefault(symbol, []).append(feat["Close"].rename(feat_safe_name(feat_config)))
+    return [save_feat_store(symbol, config, pd.concat(x, axis=1), resumed_names) for symbol, x in by_symbol.items()]
 
 
 def load_imp(symbol, config):
@@ -254,4 +644,73 @@ def save_payload(symbols, config, payload):
         path = payload_path(symbols, config)
         with open(path, 'w') as f:
             json.dump(payload, f, cls=NumpyEncoder)
-        return path
\ No newline at end of file
+        return path
+
+
+# Cell
+# Every trial of a hyperparameter search is kept in a local SQLite database. Trials are keyed by a fingerprint of
+# the search's data and estimator, so later searches on the same data can reuse and resume them, and tagged with
+# the search space (estimator, scoring and searched params), so searches on nearby data can warm-start from them
+
+
+def trials_path():
+    return DATA_DIR / "trials.sqlite"
+
+
+def connect_trials(path=None):
+    path = trials_path() if path is None else path
+    Path(path).dirname().makedirs_p()
+    conn = sqlite3.connect(str(path), timeout=60)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS trials ("
+        "fingerprint TEXT, params TEXT, n_resources REAL, fold_scores TEXT, mean_score REAL, fit_time REAL, "
+        "created REAL, space TEXT, PRIMARY KEY (fingerprint, params, n_resources))"
+    )
+    if "space" not in [x[1] for x in conn.execute("PRAGMA table_info(trials)")]:
+        conn.execute("ALTER TABLE trials ADD COLUMN space TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS trials_space ON trials (space, n_resources)")
+    return conn
+
+
+def load_trials(fingerprint, path=None):
+    """Earlier trials of a search as {(params, n_resources): {"fold_scores", "fit_time"}}, params as JSON"""
+    conn = connect_trials(path)
+    try:
+        rows = conn.execute(
+            "SELECT params, n_resources, fold_scores, fit_time FROM trials WHERE fingerprint = ?", (fingerprint,)
+        ).fetchall()
+    finally:
+        conn.close()
+    return {(params, n): {"fold_scores": json.loads(scores), "fit_time": t} for params, n, scores, t in rows}
+
+
+def load_best_trials(space, limit, path=None):
+    """The params (as JSON) of the best full-resource trials in a search space, on any data"""
+    conn = connect_trials(path)
+    try:
+        rows = conn.execute(
+            "SELECT params, MAX(mean_score) AS score FROM trials WHERE space = ? AND n_resources = 1.0 "
+            "AND mean_score IS NOT NULL GROUP BY params ORDER BY score DESC LIMIT ?",
+            (space, limit),
+        ).fetchall()
+    finally:
+        conn.close()
+    return [params for params, _ in rows]
+
+
+def save_trials(fingerprint, trials, space=None, path=None):
+    if not trials:
+        return
+    conn = connect_trials(path)
+    try:
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO trials VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (fingerprint, params, n, json.dumps(x["fold_scores"]), sum(x["fold_scores"]) / len(x["fold_scores"]),
+                     x["fit_time"], time.time(), space)
+                    for (params, n), x in trials.items()
+                ],
+            )
+    finally:
+        conn.close()
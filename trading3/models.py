@@ -1,6 +1,7 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: dev/12_models.ipynb (unless otherwise specified).
 
-__all__ = ['tpot_fit', 'clf_hyper_fit', 'get_model', 'RF_PARAM_GRID', 'XGB_PARAM_GRID', 'LGBM_PARAM_GRID',
+__all__ = ['tpot_fit', 'clf_hyper_fit', 'trial_key', 'search_fingerprint', 'search_space', 'halving_job', 'subsample',
+           'SuccessiveHalvingSearch', 'get_model', 'RF_PARAM_GRID', 'XGB_PARAM_GRID', 'LGBM_PARAM_GRID',
            'KNN_PARAM_GRID', 'SVC_PARAM_GRID', 'PARALLELIZABLE']
 
 # Cell
@@ -8,12 +9,20 @@ __all__ = ['tpot_fit', 'clf_hyper_fit', 'get_model', 'RF_PARAM_GRID', 'XGB_PARAM
 import pandas as pd
 import numpy as np
 import logging
+import json
+import hashlib
+import time
 import tpot
 
 from .utils import PurgedKFold
+from .load_data import load_trials, load_best_trials, save_trials
+from .multiprocess import process_jobs, default_backend, shared_args
 from math import ceil
+from multiprocessing import cpu_count
 
-from sklearn.model_selection import GridSearchCV, RandomizedSearchCV
+from sklearn.base import clone
+from sklearn.metrics import check_scoring
+from sklearn.model_selection import GridSearchCV, RandomizedSearchCV, ParameterGrid, ParameterSampler
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.neighbors import KNeighborsClassifier
 from sklearn.svm import SVC
@@ -64,6 +73,10 @@ def clf_hyper_fit(
     rnd_search_iter=0,
     n_jobs=-1,
     pct_embargo=0,
+    search=None,
+    halving_factor=3,
+    halving_resource="n_samples",
+    trials=False,
     **fit_params,
 ):
     if set(lbl.values) == {0, 1}:
@@ -75,7 +88,34 @@ def clf_hyper_fit(
     inner_cv = PurgedKFold(
         n_splits=cv, t1=t1, pct_embargo=pct_embargo, random_state=None
     )
-    if rnd_search_iter == 0:
+    # With trials the search reads and writes the trial store, so it skips what was evaluated before
+    fingerprint = search_fingerprint(feat, lbl, t1, pipe_clf, scoring, inner_cv, **fit_params) if trials else None
+    if search == "halving":
+        # Successive halving explores halving_factor times the candidates for about the same budget
+        gs = SuccessiveHalvingSearch(
+            estimator=pipe_clf,
+            param_distributions=param_grid,
+            scoring=scoring,
+            cv=inner_cv,
+            n_jobs=n_jobs,
+            n_candidates=rnd_search_iter * halving_factor,
+            factor=halving_factor,
+            resource=halving_resource,
+            fingerprint=fingerprint,
+        )
+    elif trials:
+        # A single round at the full resource is a plain grid (rnd_search_iter=0) or random search
+        gs = SuccessiveHalvingSearch(
+            estimator=pipe_clf,
+            param_distributions=param_grid,
+            scoring=scoring,
+            cv=inner_cv,
+            n_jobs=n_jobs,
+            n_candidates=rnd_search_iter,
+            n_rounds=1,
+            fingerprint=fingerprint,
+        )
+    elif rnd_search_iter == 0:
         gs = GridSearchCV(
             estimator=pipe_clf,
             param_grid=param_grid,
@@ -98,6 +138,207 @@ def clf_hyper_fit(
     return gs
 
 
+def trial_key(params):
+    """The params of a trial as the JSON the trial store keys them by"""
+    return json.dumps({k: v.item() if isinstance(v, np.generic) else v for k, v in params.items()}, sort_keys=True)
+
+
+def search_fingerprint(X, y, t1, estimator, scoring, cv, **fit_params):
+    """
+    Hash of everything a trial's scores depend on apart from its params: the data, labels, label ends and
+    sample weights, the feature names, the estimator with its fixed params, the scoring and the cv
+    """
+    h = hashlib.sha1()
+    for x in [X, y, t1, *[fit_params[k] for k in sorted(fit_params)]]:
+        x = x if isinstance(x, (pd.Series, pd.DataFrame)) else pd.Series(np.asarray(x).ravel())
+        h.update(pd.util.hash_pandas_object(x, index=True).values.tobytes())
+    fixed = {k: v for k, v in estimator.get_params().items() if k != "n_jobs"}
+    h.update(repr(list(getattr(X, "columns", [])) + sorted(fit_params)).encode())
+    h.update(f"{type(estimator).__name__} {sorted(fixed.items(), key=str)} {scoring}".encode())
+    h.update(f"{type(cv).__name__} {cv.n_splits} {getattr(cv, 'pct_embargo', None)}".encode())
+    return h.hexdigest()
+
+
+def search_space(estimator, scoring, param_distributions):
+    """
+    Hash of what makes trials of different searches comparable: the estimator type, the scoring and the
+    searched params. Unlike the fingerprint it leaves out the data, so searches on nearby data share it
+    """
+    return hashlib.sha1(f"{type(estimator).__name__} {scoring} {sorted(param_distributions)}".encode()).hexdigest()
+
+
+def halving_job(estimator, params, X, y, train, test, scoring, fit_params):
+    """Fit a candidate on the train rows and score it on the test rows, returns the score and fit time"""
+    start = time.time()
+    est = clone(estimator).set_params(**params)
+    est.fit(X[train], y[train], **{k: v[train] for k, v in fit_params.items()})
+    fit_time = time.time() - start
+    return check_scoring(est, scoring=scoring)(est, X[test], y[test]), fit_time
+
+
+def subsample(rows, fraction):
+    # Evenly spaced, so that a fraction of the rows still covers the whole period
+    return rows[np.unique(np.linspace(0, len(rows) - 1, int(len(rows) * fraction)).astype(int))]
+
+
+class SuccessiveHalvingSearch:
+    """
+    Successive halving over candidates sampled from param_distributions (all of the grid for n_candidates=0).
+    Every round scores the remaining candidates on the (purged) cv folds and keeps the best 1/factor,
+    giving the survivors factor times the resource: the number of trees (resource="n_estimators") or the
+    fraction of every fold's train rows (resource="n_samples", evenly spaced to cover the whole period).
+    The last round uses the full resource, n_rounds=1 makes it a plain grid or random search. Offers the
+    fit/best_estimator_/best_params_/cv_results_ of sklearn's searches.
+    With a fingerprint (see search_fingerprint) every trial goes to the trial store as soon as its batch of
+    candidates is scored: trials evaluated before are read back instead of refitted, which resumes an
+    interrupted search. The warm_start best earlier candidates at the full resource in the same search space
+    (see search_space), on any data, join the candidates.
+    """
+
+    def __init__(
+        self,
+        estimator,
+        param_distributions,
+        scoring,
+        cv,
+        n_jobs=1,
+        n_candidates=0,
+        factor=3,
+        resource="n_samples",
+        min_samples=100,
+        random_state=None,
+        n_rounds=None,
+        fingerprint=None,
+        warm_start=5,
+    ):
+        if resource not in ["n_samples", "n_estimators"]:
+            raise ValueError(f"unknown resource {resource}")
+        if resource == "n_estimators" and "n_estimators" not in estimator.get_params():
+            raise ValueError(f"resource n_estimators needs an ensemble, {type(estimator).__name__} has no n_estimators")
+        self.estimator = estimator
+        self.param_distributions = param_distributions
+        self.scoring = scoring
+        self.cv = cv
+        self.n_jobs = n_jobs
+        self.n_candidates = n_candidates
+        self.factor = factor
+        self.resource = resource
+        self.min_samples = min_samples
+        self.random_state = random_state
+        self.n_rounds = n_rounds
+        self.fingerprint = fingerprint
+        self.warm_start = warm_start
+
+    def candidates(self):
+        params = dict(self.param_distributions)
+        max_resource = None
+        if self.resource == "n_estimators":
+            # The number of trees is the resource, so it's no longer a parameter to search
+            default = [self.estimator.get_params()["n_estimators"]]
+            max_resource = int(max(params.pop("n_estimators", default)))
+        random_state = self.random_state
+        if random_state is None and self.fingerprint is not None:
+            # Sample the same candidates every time the search runs on the same data, so a rerun resumes it
+            random_state = int(self.fingerprint[:8], 16)
+        if self.n_candidates and self.n_candidates < len(ParameterGrid(params)):
+            candidates = list(ParameterSampler(params, self.n_candidates, random_state=random_state))
+        else:
+            candidates = list(ParameterGrid(params))
+
+        if self.fingerprint is not None and self.warm_start:
+            # The best earlier candidates in the same search space, whatever data they were scored on
+            seen, seeds = {trial_key(x) for x in candidates}, []
+            for key in load_best_trials(self.space(), len(candidates) + self.warm_start):
+                x = json.loads(key)
+                if self.resource == "n_estimators":
+                    x.pop("n_estimators", None)
+                if trial_key(x) not in seen and len(seeds) < self.warm_start:
+                    seen.add(trial_key(x))
+                    seeds.append(x)
+            candidates += seeds
+        return candidates, max_resource
+
+    def space(self):
+        return search_space(self.estimator, self.scoring, self.param_distributions)
+
+    def fit(self, X, y, **fit_params):
+        known = load_trials(self.fingerprint) if self.fingerprint is not None else {}
+        candidates, max_resource = self.candidates()
+        folds = list(self.cv.split(X))
+        n_rounds = 1 + int(np.floor(np.log(len(candidates)) / np.log(self.factor))) if len(candidates) > 1 else 1
+        if self.resource == "n_samples":
+            min_train = min(len(train) for train, _ in folds)
+            n_rounds = min(n_rounds, 1 + max(0, int(np.log(min_train / self.min_samples) / np.log(self.factor))))
+        else:
+            n_rounds = min(n_rounds, 1 + int(np.log(max_resource) / np.log(self.factor)))
+        if self.n_rounds is not None:
+            n_rounds = min(n_rounds, self.n_rounds)
+
+        n_jobs = cpu_count() if self.n_jobs == -1 else self.n_jobs
+        backend = default_backend(n_jobs)
+        fit_params = {k: np.asarray(v) for k, v in fit_params.items()}
+
+        results, alive = [], list(range(len(candidates)))
+        with shared_args({"X": np.asarray(X), "y": np.asarray(y)}, backend, "halving_") as args:
+            for i in range(n_rounds):
+                shrink = self.factor ** (n_rounds - 1 - i)
+                params, round_folds, train_fraction = [dict(candidates[c]) for c in alive], folds, 1.0
+                if self.resource == "n_estimators":
+                    n_resources = max(1, max_resource // shrink)
+                    for x in params:
+                        x["n_estimators"] = n_resources
+                else:
+                    n_resources = train_fraction = 1.0 / shrink
+                    round_folds = [(subsample(train, n_resources), test) for train, test in folds]
+
+                # Trials are keyed by their params and the fraction of the train rows they were fitted on
+                keys = [(trial_key(x), train_fraction) for x in params]
+                todo = [j for j, k in enumerate(keys) if len(known.get(k, {}).get("fold_scores", [])) != len(folds)]
+                if len(todo) < len(params):
+                    logging.info(f"halving round {i + 1}/{n_rounds}: {len(params) - len(todo)} trials known")
+                # Score the candidates in batches that keep every worker busy, storing each batch as it's done
+                batch_size = max(1, n_jobs) if self.fingerprint is not None else len(todo)
+                for b in range(0, len(todo), max(1, batch_size)):
+                    batch = todo[b : b + batch_size]
+                    jobs = [
+                        dict(func=halving_job, estimator=self.estimator, params=params[j], train=train, test=test,
+                             scoring=self.scoring, fit_params=fit_params, **args)
+                        for j in batch
+                        for train, test in round_folds
+                    ]
+                    out = process_jobs(jobs, task=f"halving round {i + 1}/{n_rounds}", num_threads=n_jobs,
+                                       backend=backend)
+                    trials = {}
+                    for n, j in enumerate(batch):
+                        fold_out = out[n * len(folds) : (n + 1) * len(folds)]
+                        trials[keys[j]] = {"fold_scores": [float(score) for score, _ in fold_out],
+                                           "fit_time": float(sum(t for _, t in fold_out))}
+                    known.update(trials)
+                    if self.fingerprint is not None:
+                        save_trials(self.fingerprint, trials, self.space())
+
+                scores = np.array([known[k]["fold_scores"] for k in keys], dtype=np.float64)
+                for c, x, k, score in zip(alive, params, keys, scores):
+                    results.append({"params": x, "mean_test_score": np.mean(score), "std_test_score": np.std(score),
+                                    "mean_fit_time": known[k]["fit_time"] / len(folds), "n_resources": n_resources,
+                                    "iter": i, "candidate": c})
+                logging.info(f"halving round {i + 1}/{n_rounds}: {len(alive)} candidates on {n_resources} {self.resource}")
+                mean = scores.mean(axis=1)
+                mean[np.isnan(mean)] = -np.inf
+                if i < n_rounds - 1:
+                    keep = max(1, int(ceil(len(alive) / self.factor)))
+                    alive = [alive[j] for j in np.argsort(-mean, kind="stable")[:keep]]
+                else:
+                    best_index = len(results) - len(alive) + int(np.argmax(mean))
+
+        self.cv_results_ = {k: [x[k] for x in results] for k in results[0]}
+        self.best_index_ = best_index
+        self.best_params_ = results[best_index]["params"]
+        self.best_score_ = results[best_index]["mean_test_score"]
+        self.best_estimator_ = clone(self.estimator).set_params(**self.best_params_).fit(X, y, **fit_params)
+        return self
+
+
 RF_PARAM_GRID = {
     "n_estimators": np.arange(25, 525, 25),
     "max_depth": np.arange(1, 11, 1),
@@ -138,6 +379,10 @@ def get_model(
     num_threads=32,
     n_jobs=4,
     hyper_params=None,
+    hyper_search="random",
+    halving_factor=3,
+    halving_resource="n_samples",
+    hyper_trials=False,
 ):
     # X_all and y_all in this context are X_train and y_train in the grander scheme
     logging.info(f"Getting model {clf_type}")
@@ -192,9 +437,18 @@ def get_model(
             param_grid=param_grid,
             rnd_search_iter=hypers_n_iter,
             n_jobs=num_threads,
+            search=hyper_search,
+            halving_factor=halving_factor,
+            halving_resource=halving_resource,
+            trials=hyper_trials,
         )
         search_results = pd.DataFrame(search.cv_results_)
-        best1_idx = search_results["mean_test_score"].idxmax()
+        # Successive halving's early rounds score candidates on a fraction of the resource, its best is
+        # the best of the last round
+        if isinstance(search, SuccessiveHalvingSearch):
+            best1_idx = search.best_index_
+        else:
+            best1_idx = search_results["mean_test_score"].idxmax()
 
         clf, hyper_params = (
             search.best_estimator_,
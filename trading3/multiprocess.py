@@ -1,5 +1,8 @@
-__all__ = ['lin_parts', 'nested_parts', 'mp_pandas_obj', 'process_jobs_', 'report_progress', 'process_jobs',
-           'expand_call', '#', '#', '#', '#']
+__all__ = ['lin_parts', 'nested_parts', 'cost_parts', 'mp_pandas_obj', 'process_jobs_', 'report_progress',
+           'process_jobs', 'BACKENDS', 'SerialPool', 'ClusterClientManager', 'ClusterServerManager', 'ClusterPool',
+           'cluster_worker', 'default_backend', 'get_pool', 'shutdown_pools', 'expand_call', 'expand_indexed_call',
+           'SHARED_MEMORY_DIR', 'SHARE_MIN_BYTES', 'is_shareable', 'SharedArg', 'attach_arg', 'shared_nbytes',
+           'share_arg', 'shared_dir_root', 'remove_shared_dirs', 'shared_args', '#', '#', '#', '#']
 
 # Cell
 
@@ -9,6 +12,9 @@ import numpy as np
 import time
 import sys
 import os
+import shutil
+import tempfile
+from contextlib import contextmanager
 
 
 def lin_parts(num_atoms, num_threads):
@@ -34,40 +40,76 @@ def nested_parts(num_atoms, num_threads, upper_triang=False):
     return parts
 
 
-def mp_pandas_obj(func, pd_obj, num_threads=32, mp_batches=1, lin_mols=True, **kargs):
+def cost_parts(costs, num_threads):
+    # partition of atoms into molecules of roughly equal total (estimated) cost.
+    # lin_parts and nested_parts are the special cases of constant and linearly growing costs
+    cum_costs = np.cumsum(costs, dtype=np.float64)
+    if not len(cum_costs) or cum_costs[-1] <= 0:
+        return lin_parts(len(cum_costs), num_threads)
+    num_parts = min(num_threads, len(cum_costs))
+    targets = cum_costs[-1] * np.arange(1, num_parts) / num_parts
+    parts = np.searchsorted(cum_costs, targets, side="right")
+    parts = np.unique(np.concatenate([[0], parts, [len(cum_costs)]]))
+    return parts
+
+
+def mp_pandas_obj(
+    func,
+    pd_obj,
+    num_threads=32,
+    mp_batches=1,
+    lin_mols=True,
+    share_memory=False,
+    backend=None,
+    costs=None,
+    **kargs
+):
     """
     Parallelize jobs, return a dataframe or series
     + func: function to be parallelized. Returns a DataFrame
     + pd_obj[0]: Name of argument used to pass the molecule
     + pd_obj[1]: List of atoms that will be grouped into molecules
+    + share_memory: dump large NumPy/pandas kwds to memory-mapped files once, instead of pickling
+      them into every job. Workers attach to them as read-only views (see shared_args)
+    + backend: one of BACKENDS, by default "serial" for num_threads=1 and "processes" otherwise
+    + costs: optional cost estimate per atom, molecules are then cut to equal total cost and the
+      heaviest ones are dispatched first. Use mp_batches > 1 to let idle workers pick up the slack
     + kwds: any other argument needed by func
     Example: df1=mp_pandas_obj(func,('molecule',df0.index),24,**kwds)
     """
     import pandas as pd
 
-    if lin_mols:
+    if backend is None:
+        backend = default_backend(num_threads)
+
+    if costs is not None:
+        costs = np.asarray(costs, dtype=np.float64)
+        parts = cost_parts(costs, num_threads * mp_batches)
+    elif lin_mols:
         parts = lin_parts(len(pd_obj[1]), num_threads * mp_batches)
     else:
         parts = nested_parts(len(pd_obj[1]), num_threads * mp_batches)
 
-    jobs = []
-    for i in range(1, len(parts)):
-        job = {pd_obj[0]: pd_obj[1][parts[i - 1] : parts[i]], "func": func}
-        job.update(kargs)
-        jobs.append(job)
-    if num_threads == 1:
-        out = process_jobs_(jobs)
-    else:
-        out = process_jobs(jobs, num_threads=num_threads)
-    if isinstance(out[0], pd.DataFrame):
-        df0 = pd.DataFrame()
-    elif isinstance(out[0], pd.Series):
-        df0 = pd.Series()
-    else:
+    job_costs = None
+    if costs is not None:
+        job_costs = [np.sum(costs[parts[i - 1] : parts[i]]) for i in range(1, len(parts))]
+    with shared_args(kargs if share_memory else {}, backend, "mp_pandas_obj_") as shared:
+        jobs = []
+        for i in range(1, len(parts)):
+            job = {pd_obj[0]: pd_obj[1][parts[i - 1] : parts[i]], "func": func}
+            job.update(kargs)
+            job.update(shared)
+            jobs.append(job)
+        if backend == "serial":
+            out = process_jobs_(jobs)
+        else:
+            out = process_jobs(jobs, num_threads=num_threads, backend=backend, job_costs=job_costs)
+    if not isinstance(out[0], (pd.DataFrame, pd.Series)):
         return out
-    for i in out:
-        df0 = df0.append(i)
-    df0 = df0.sort_index()
+    # out is in molecule order, so for the usual sorted atoms a single concat is already sorted
+    df0 = pd.concat(out)
+    if not df0.index.is_monotonic_increasing:
+        df0 = df0.sort_index()
     return df0
 
 
@@ -86,6 +128,11 @@ def process_jobs_(jobs):
 # Example of async call to multiprocessing lib [20.9]
 import multiprocessing as mp
 import datetime as dt
+import atexit
+import queue
+import traceback
+from multiprocessing.managers import BaseManager
+from multiprocessing.pool import ThreadPool
 
 # ________________________________
 def report_progress(job_num, num_jobs, time0, task):
@@ -113,32 +160,346 @@ def report_progress(job_num, num_jobs, time0, task):
 
 
 # ________________________________
-def process_jobs(jobs, task=None, num_threads=36):
-    # Run in parallel.
+def process_jobs(jobs, task=None, num_threads=36, backend="processes", job_costs=None):
+    # Run in parallel on the long-lived pool of `backend`, returning outputs in the order of jobs.
     # jobs must contain a 'func' callback, for expandCall
     if task is None:
         task = jobs[0]["func"].__name__
-    pool = mp.Pool(processes=num_threads)
-    outputs, out, time0 = pool.imap_unordered(expand_call, jobs), [], time.time()
+    pool = get_pool(num_threads, backend)
+    order = range(len(jobs)) if job_costs is None else np.argsort(job_costs, kind="stable")[::-1]
+    # Workers pull one job at a time, so a worker that's done with a light job simply takes the next one
+    outputs = pool.imap_unordered(expand_indexed_call, ((i, jobs[i]) for i in order))
+    out, time0 = [None] * len(jobs), time.time()
     # Process asyn output, report progress
-    for i, out_ in enumerate(outputs, 1):
-        out.append(out_)
+    for i, (job_num, out_) in enumerate(outputs, 1):
+        out[job_num] = out_
         report_progress(i, len(jobs), time0, task)
-    pool.close()
-    pool.join()  # this is needed to prevent memory leaks
     return out
 
 
+# ________________________________
+# Execution backends. Every backend is a pool offering imap_unordered, close and join:
+# + serial: in this process, for debugging
+# + threads: for kernels that release the GIL (NumPy, compiled code), no pickling at all
+# + processes: a multiprocessing pool on this machine
+# + cluster: workers pulling jobs from a queue served over a socket, see ClusterPool
+BACKENDS = ["serial", "threads", "processes", "cluster"]
+
+
+class SerialPool:
+    def imap_unordered(self, func, iterable):
+        return map(func, iterable)
+
+    def close(self):
+        pass
+
+    def join(self):
+        pass
+
+
+class ClusterClientManager(BaseManager):
+    pass
+
+
+ClusterClientManager.register("jobs")
+ClusterClientManager.register("results")
+
+# The queues live in the manager process of a ClusterPool, every pool starts its own
+_CLUSTER_JOBS, _CLUSTER_RESULTS = queue.Queue(), queue.Queue()
+
+
+def _cluster_jobs():
+    return _CLUSTER_JOBS
+
+
+def _cluster_results():
+    return _CLUSTER_RESULTS
+
+
+class ClusterServerManager(BaseManager):
+    pass
+
+
+ClusterServerManager.register("jobs", callable=_cluster_jobs)
+ClusterServerManager.register("results", callable=_cluster_results)
+
+
+class ClusterPool:
+    """
+    Local stand-in for a multi-node scheduler. A manager process serves a job and a result queue over a
+    socket. Workers (num_workers local processes, plus cluster_worker() started on any other node that
+    can reach `address` with the same authkey) each pull one job at a time, so faster workers take more
+    jobs and skewed molecules don't leave the others idle.
+    """
+
+    def __init__(self, num_workers, address=("127.0.0.1", 0), authkey=b"mlbt"):
+        # In its own process, as stopping a server running in ours would reset sys.stdout and sys.stderr
+        self._manager = ClusterServerManager(address=address, authkey=authkey)
+        self._manager.start()
+
+        self.address, self.authkey = self._manager.address, authkey
+        self._jobs, self._results, self._calls = self._manager.jobs(), self._manager.results(), 0
+        self._workers = [
+            mp.Process(target=cluster_worker, args=(self.address, authkey), daemon=True)
+            for _ in range(num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def imap_unordered(self, func, iterable):
+        self._calls += 1
+        call, num_jobs = self._calls, 0
+        for arg in iterable:
+            self._jobs.put((call, func, arg))
+            num_jobs += 1
+        while num_jobs:
+            call_, ok, out = self._results.get()
+            if call_ != call:
+                continue  # left over from an earlier call that failed
+            if not ok:
+                raise RuntimeError(f"cluster job failed:\n{out}")
+            num_jobs -= 1
+            yield out
+
+    def close(self):
+        for _ in self._workers:
+            self._jobs.put(None)
+
+    def join(self):
+        for worker in self._workers:
+            worker.join()
+        self._manager.shutdown()
+
+
+def cluster_worker(address, authkey=b"mlbt"):
+    """Run jobs from the ClusterPool at `address` until it shuts down. Can be started on any node"""
+    manager = ClusterClientManager(address=address, authkey=authkey)
+    manager.connect()
+    jobs, results = manager.jobs(), manager.results()
+    while True:
+        try:
+            item = jobs.get()
+        except (EOFError, OSError):
+            break  # the scheduler went away
+        if item is None:
+            break
+        call, func, arg = item
+        try:
+            results.put((call, True, func(arg)))
+        except Exception:
+            results.put((call, False, traceback.format_exc()))
+
+
+# ________________________________
+# Forking a pool and re-importing our modules in every worker is too expensive to pay for every
+# symbol and stage of a run, so pools are kept alive (one per backend and size) until shutdown_pools().
+# They're keyed by the owning process too: a forked child inherits the parent's pools, whose workers
+# and handler threads only exist in the parent, so the child has to start its own
+_POOLS = {}
+
+
+def default_backend(num_threads):
+    return "serial" if num_threads == 1 else "processes"
+
+
+def get_pool(num_threads, backend="processes"):
+    pid = os.getpid()
+    for key in [key for key in _POOLS if key[0] != pid]:
+        del _POOLS[key]
+    pool = _POOLS.get((pid, backend, num_threads))
+    if pool is None:
+        if backend == "serial":
+            pool = SerialPool()
+        elif backend == "threads":
+            pool = ThreadPool(processes=num_threads)
+        elif backend == "processes":
+            pool = mp.Pool(processes=num_threads)
+        elif backend == "cluster":
+            pool = ClusterPool(num_workers=num_threads)
+        else:
+            raise ValueError(f"unknown backend {backend}, pick one of {BACKENDS}")
+        _POOLS[(pid, backend, num_threads)] = pool
+    return pool
+
+
+def shutdown_pools():
+    while _POOLS:
+        (pid, _, _), pool = _POOLS.popitem()
+        if pid != os.getpid():
+            continue  # inherited from the parent, which shuts it down
+        pool.close()
+        pool.join()  # this is needed to prevent memory leaks
+    # With the workers gone their mappings are too, so the shared files they kept from being removed can be
+    remove_shared_dirs()
+
+
+atexit.register(shutdown_pools)
+
+
 # =======================================================
 # Unwrapping the Callback [20.10]
 def expand_call(kargs):
     # Expand the arguments of a callback function, kargs['func']
     func = kargs["func"]
     del kargs["func"]
+    kargs = {k: attach_arg(v) for k, v in kargs.items()}
     out = func(**kargs)
     return out
 
 
+def expand_indexed_call(indexed_kargs):
+    # expand_call for (job number, kargs) pairs, so outputs can be put back in order
+    job_num, kargs = indexed_kargs
+    return job_num, expand_call(kargs)
+
+
+# =======================================================
+# Sharing large arguments between processes without pickling them into every job
+# /dev/shm keeps the memory-mapped files in RAM where available. It's often small in containers,
+# so arguments that don't fit in it go to the temp dir instead. Set to None to always use the temp dir
+SHARED_MEMORY_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+SHARE_MIN_BYTES = 1 << 20
+# Shared dirs that couldn't be removed yet, Windows doesn't delete files that are still mapped
+_STALE_SHARED_DIRS = []
+
+
+def is_shareable(obj):
+    # Only plain numeric/datetime NumPy data can be memory-mapped, anything else gets pickled as usual
+    def plain(dtype):
+        return isinstance(dtype, np.dtype) and dtype.kind in "biufcmM"
+
+    if isinstance(obj, np.ndarray):
+        return plain(obj.dtype)
+    if isinstance(obj, pd.Series):
+        return plain(obj.dtype) and plain(obj.index.dtype)
+    if isinstance(obj, pd.DataFrame):
+        return all(plain(x) for x in obj.dtypes) and plain(obj.index.dtype)
+    return False
+
+
+class SharedArg:
+    """
+    Picklable handle to a NumPy array, Series or DataFrame whose data has been saved once to .npy files
+    in `directory`. attach() memory-maps them read-only and rebuilds the object around those views.
+    A DataFrame is saved as one 2-D array per run of same-dtype columns, which become its blocks as they
+    are, so its columns stay views onto the mapping as well
+    """
+
+    def __init__(self, obj, directory):
+        self.kind = type(obj).__name__
+        self.paths = {}
+        self.meta = {}
+        if isinstance(obj, np.ndarray):
+            self.paths["values"] = self._save(obj, directory)
+            return
+
+        self.paths["index"] = self._save(obj.index.values, directory)
+        self.meta["index_name"] = obj.index.name
+        if isinstance(obj, pd.Series):
+            self.paths["values"] = self._save(obj.values, directory)
+            self.meta["name"] = obj.name
+            return
+
+        self.meta["columns"] = list(obj.columns)
+        self.paths["blocks"] = []
+        start = 0
+        for stop in range(1, obj.shape[1] + 1):
+            if stop == obj.shape[1] or obj.dtypes.iloc[stop] != obj.dtypes.iloc[start]:
+                # Transposed, so that every column is contiguous in the file like in a pandas block
+                block = np.ascontiguousarray(obj.iloc[:, start:stop].values.T)
+                self.paths["blocks"].append((start, stop, self._save(block, directory)))
+                start = stop
+
+    @staticmethod
+    def _save(arr, directory):
+        fd, path = tempfile.mkstemp(suffix=".npy", dir=directory)
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, arr, allow_pickle=False)
+        return path
+
+    @staticmethod
+    def _load(path):
+        return np.load(path, mmap_mode="r", allow_pickle=False)
+
+    def attach(self):
+        if self.kind == "ndarray":
+            return self._load(self.paths["values"])
+
+        index = pd.Index(self._load(self.paths["index"]), name=self.meta["index_name"])
+        if self.kind == "Series":
+            return pd.Series(self._load(self.paths["values"]), index=index, name=self.meta["name"])
+        columns = self.meta["columns"]
+        # A frame around a single 2-D array doesn't copy it, and neither does concatenating the frames,
+        # unlike building one from a dict of columns, which consolidates them into new blocks
+        frames = [
+            pd.DataFrame(self._load(path).T, index=index, columns=columns[start:stop], copy=False)
+            for start, stop, path in self.paths["blocks"]
+        ]
+        if not frames:
+            return pd.DataFrame(index=index, columns=columns)
+        if len(frames) == 1:
+            return frames[0]
+        return pd.concat(frames, axis=1, copy=False)
+
+
+def attach_arg(arg):
+    return arg.attach() if isinstance(arg, SharedArg) else arg
+
+
+def shared_nbytes(obj, min_bytes=SHARE_MIN_BYTES):
+    """Bytes that sharing obj would write, 0 for objects that aren't shared"""
+    if not is_shareable(obj):
+        return 0
+    nbytes = obj.nbytes if isinstance(obj, np.ndarray) else obj.memory_usage(index=True, deep=False)
+    nbytes = int(np.sum(nbytes))
+    return nbytes if nbytes >= min_bytes else 0
+
+
+def share_arg(obj, directory, min_bytes=SHARE_MIN_BYTES):
+    """Swap a large NumPy/pandas argument for a SharedArg handle, leave everything else as is"""
+    if not shared_nbytes(obj, min_bytes):
+        return obj
+    return SharedArg(obj, directory)
+
+
+def shared_dir_root(nbytes):
+    """SHARED_MEMORY_DIR if it has room for nbytes more, otherwise the temp dir"""
+    if SHARED_MEMORY_DIR is not None and shutil.disk_usage(SHARED_MEMORY_DIR).free > nbytes + SHARE_MIN_BYTES:
+        return SHARED_MEMORY_DIR
+    return tempfile.gettempdir()
+
+
+def remove_shared_dirs(*paths):
+    """Remove shared dirs, keeping the ones whose files are still in use to retry on the next call"""
+    paths = list(paths) + _STALE_SHARED_DIRS
+    del _STALE_SHARED_DIRS[:]
+    for path in paths:
+        try:
+            shutil.rmtree(path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            _STALE_SHARED_DIRS.append(path)
+
+
+@contextmanager
+def shared_args(args, backend, prefix="shared_"):
+    """
+    Yield args with the large NumPy/pandas values swapped for SharedArg handles, removing their files on
+    exit. Only process workers on this machine get handles: serial and thread workers use the objects as
+    they are, and cluster workers may run on other nodes, which can't see our files, so they get pickles
+    """
+    if backend != "processes":
+        yield args
+        return
+    nbytes = sum(shared_nbytes(v) for v in args.values())
+    shared_dir = tempfile.mkdtemp(prefix=prefix, dir=shared_dir_root(nbytes))
+    try:
+        yield {k: share_arg(v, shared_dir) for k, v in args.items()}
+    finally:
+        remove_shared_dirs(shared_dir)
+
+
 # =======================================================
 # Pickle Unpickling Objects [20.11]
 def _pickle_method(method):
@@ -160,4 +521,4 @@ def _unpickle_method(func_name, obj, cls):
     return func.__get__(obj, cls)
 
 
-# ________________________________
\ No newline at end of file
+# ________________________________
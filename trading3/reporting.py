@@ -1,10 +1,11 @@
-__all__ = ['run_val', 'get_roc_curve', 'prep_events', 'get_reports']
+__all__ = ['rows_view', 'val_job', 'WARM_START_CLFS', 'warm_start_fit', 'val_splits', 'val_rows', 'fit_predict_rounds',
+           'run_val', 'cpcv_paths', 'path_stats', 'run_cpcv', 'get_roc_curve', 'prep_events', 'get_reports']
 
 # Cell
 import numpy as np
-import pandas as pd
 import logging
 
+from sklearn.base import clone
 from sklearn.metrics import (
     roc_auc_score,
     roc_curve,
@@ -14,40 +15,185 @@ from sklearn.metrics import (
 )
 from timeseriescv.cross_validation import PurgedWalkForwardCV, CombPurgedKFoldCV
 from .single_wf_cv import SinglePurgedWalkForwardCV
+from .multiprocess import process_jobs, default_backend, shared_args
 
 
-def run_val(cv, events, clf, X_train, y_train, X_test, y_test):
-    test_indices, y_truths, y_preds, y_preds_proba = [], [], [], []
+def rows_view(arr, rows):
+    """arr[rows] for sorted rows, as a view rather than a copy when they're contiguous"""
+    if len(rows) and rows[-1] - rows[0] + 1 == len(rows):
+        return arr[rows[0] : rows[-1] + 1]
+    return arr[rows]
+
+
+def val_job(clf, X, y, train, test):
+    """Fit a fresh copy of clf on the train rows, returns its classes and probabilities on the test rows"""
+    clf = clone(clf).fit(rows_view(X, train), rows_view(y, train))
+    return clf.classes_, clf.predict_proba(rows_view(X, test))
+
+
+# Models that can extend an earlier fit with trees fitted on more data
+WARM_START_CLFS = ["LGBMClassifier", "XGBClassifier", "RandomForestClassifier"]
+
+
+def warm_start_fit(clf, prev, X, y):
+    """Fit clf on X and y, adding its trees to those of prev (a fitted model of the same type) if given"""
+    name = type(clf).__name__
+    if prev is None:
+        return clone(clf).fit(X, y)
+    if name == "LGBMClassifier":
+        return clone(clf).fit(X, y, init_model=prev.booster_)
+    if name == "XGBClassifier":
+        return clone(clf).fit(X, y, xgb_model=prev.get_booster())
+    prev.set_params(warm_start=True, n_estimators=prev.n_estimators + clf.n_estimators)
+    return prev.fit(X, y)
+
+
+def val_splits(cv, events, X_test):
     pred_times = events.index.to_series().reindex(X_test.index)
 
     eval_times = events["t1"].reindex(X_test.index)
 
-    train_test_splits = cv.split(X_test, pred_times=pred_times, eval_times=eval_times)
-    for i, (train_index, test_index) in enumerate(train_test_splits):
-        logging.info(f"Running validation for {type(clf).__name__}: round {i + 1}/{cv.n_splits - 1}")
-        X_train_ = pd.concat([X_train, X_test.iloc[train_index]])
-        X_test_ = X_test.iloc[test_index]
-        y_train_ = pd.concat([y_train, y_test.iloc[train_index]])
-        y_test_ = y_test.iloc[test_index]
+    return list(cv.split(X_test, pred_times=pred_times, eval_times=eval_times))
+
+
+def val_rows(X_train, y_train, X_test, y_test, splits):
+    """
+    The train and test sets concatenated once into arrays, with every split's train rows (all of the train
+    set plus its rows of the test set) and test rows in them
+    """
+    n_train = X_train.shape[0]
+    X = np.concatenate([X_train.values, X_test.values])
+    y = np.concatenate([y_train.values, y_test.values])
+    rows = [
+        (np.concatenate([np.arange(n_train), n_train + np.asarray(train_index)]), n_train + np.asarray(test_index))
+        for train_index, test_index in splits
+    ]
+    return X, y, rows
+
+
+def fit_predict_rounds(clf, X, y, rows, num_threads=1, backend=None):
+    """Fit clf on the train rows and predict the test rows of every round on num_threads"""
+    name = type(clf).__name__
+    num_threads = min(num_threads, len(rows))
+    backend = backend or default_backend(num_threads)
+    logging.info(f"Running validation for {name}: {len(rows)} rounds on {num_threads} workers")
+    with shared_args({"X": X, "y": y}, backend, "val_") as args:
+        jobs = [dict(func=val_job, clf=clf, train=train, test=test, **args) for train, test in rows]
+        return process_jobs(jobs, task=f"validation of {name}", num_threads=num_threads, backend=backend)
 
-        if clf is not None:
-            clf.fit(X_train_, y_train_)
 
-            y_pred = clf.predict(X_test_)
-            y_pred_proba = clf.predict_proba(X_test_)[:, 1]
-        else:
-            # Running without using meta-labeling
-            y_pred = y_pred_proba = pd.Series(1, index=X_test_)
+def run_val(cv, events, clf, X_train, y_train, X_test, y_test, num_threads=1, warm_start=False, backend=None):
+    """
+    Walk through the splits of cv over the test set, every round training on the train set plus the test
+    rounds' train rows and predicting its test rows. Rounds are independent and run on num_threads, unless
+    warm_start where the model supports it: then every round extends the model of the previous round,
+    starting over whenever a round's test rows were trained on by the previous ones (e.g. with cpcv)
+    """
+    train_test_splits = val_splits(cv, events, X_test)
+    test_indices = [test_index for _, test_index in train_test_splits]
+    y_truths = [y_test.iloc[test_index].values for test_index in test_indices]
+    if clf is None:
+        # Running without using meta-labeling
+        y_preds = y_preds_proba = [np.ones(len(test_index)) for test_index in test_indices]
+        rets = [y_truths, y_preds, y_preds_proba, test_indices]
+        return [np.concatenate(ret) for ret in rets]
 
-        test_indices.append(test_index)
-        y_truths.append(y_test_)
-        y_preds.append(y_pred)
-        y_preds_proba.append(y_pred_proba)
+    X, y, rows = val_rows(X_train, y_train, X_test, y_test, train_test_splits)
+    name = type(clf).__name__
+    if warm_start and name in WARM_START_CLFS:
+        logging.info(f"Running validation for {name}: {len(rows)} warm-started rounds")
+        out, model, seen = [], None, np.zeros(X.shape[0], dtype=bool)
+        for i, (train, test) in enumerate(rows):
+            if seen[test].any():
+                model, seen[:] = None, False
+            model = warm_start_fit(clf, model, rows_view(X, train), rows_view(y, train))
+            seen[train] = True
+            out.append((model.classes_, model.predict_proba(rows_view(X, test))))
+    else:
+        out = fit_predict_rounds(clf, X, y, rows, num_threads, backend)
+
+    # Labels and probabilities both come from the one predict_proba pass
+    y_preds = [classes[proba.argmax(axis=1)] for classes, proba in out]
+    y_preds_proba = [proba[:, 1] for _, proba in out]
 
     rets = [y_truths, y_preds, y_preds_proba, test_indices]
     return [np.concatenate(ret) for ret in rets]
 
 
+# Cell
+
+def cpcv_paths(test_groups):
+    """
+    Given the test groups of every CPCV combination (in split order), the combination every backtest path
+    takes each group's predictions from, as paths[p][g]. A group's predictions go to the paths in the order
+    of the combinations testing it, giving phi = n_test_splits / n_splits * C(n_splits, n_test_splits) paths
+    """
+    n_groups = max(max(x) for x in test_groups) + 1
+    counts, paths = [0] * n_groups, []
+    for c, groups in enumerate(test_groups):
+        for g in groups:
+            if counts[g] == len(paths):
+                paths.append([None] * n_groups)
+            paths[counts[g]][g] = c
+            counts[g] += 1
+    return paths
+
+
+def path_stats(events, y_true, y_pred, y_pred_proba):
+    stats = {
+        "f1_score": f1_score(y_true, y_pred, average="micro", zero_division=0),
+        "roc_auc_score": roc_auc_score(y_true, y_pred_proba) if len(np.unique(y_true)) == 2 else None,
+    }
+    if "ret" in events:
+        # Returns of taking the predicted position on every event, a per-bet Sharpe ratio
+        rets = events["ret"].values * y_pred
+        stats["mean_ret"] = np.mean(rets)
+        stats["sharpe_ratio"] = np.mean(rets) / np.std(rets) if np.std(rets) > 0 else None
+    return stats
+
+
+def run_cpcv(cv, events, clf, X_train, y_train, X_test, y_test, num_threads=1, backend=None):
+    """
+    Combinatorial purged cross-validation: fit every train/test combination of cv (a CombPurgedKFoldCV)
+    on num_threads and rebuild the backtest paths from their predictions, every path covering the whole
+    test set. Returns the paths (y_true, y_pred, y_pred_proba and test_indices into the test set) and
+    their stats
+    """
+    splits = val_splits(cv, events, X_test)
+    # The groups are the contiguous folds CombPurgedKFoldCV makes, every combination tests n_test_splits of them
+    group = np.empty(X_test.shape[0], dtype=int)
+    for g, fold in enumerate(np.array_split(np.arange(X_test.shape[0]), cv.n_splits)):
+        group[fold] = g
+    test_groups = [np.unique(group[test_index]) for _, test_index in splits]
+
+    if clf is None:
+        # Running without using meta-labeling
+        out = [(np.array([1]), np.ones((len(test_index), 1))) for _, test_index in splits]
+    else:
+        X, y, rows = val_rows(X_train, y_train, X_test, y_test, splits)
+        out = fit_predict_rounds(clf, X, y, rows, num_threads, backend)
+
+    paths, stats = [], []
+    for combinations in cpcv_paths(test_groups):
+        parts = []
+        for g, c in enumerate(combinations):
+            test_index = np.asarray(splits[c][1])
+            in_group = group[test_index] == g
+            classes, proba = out[c]
+            parts.append((test_index[in_group], classes[proba[in_group].argmax(axis=1)], proba[in_group, -1]))
+        test_indices = np.concatenate([x[0] for x in parts])
+        path = {
+            "y_true": y_test.iloc[test_indices].values,
+            "y_pred": np.concatenate([x[1] for x in parts]),
+            "y_pred_proba": np.concatenate([x[2] for x in parts]),
+            "test_indices": test_indices,
+        }
+        paths.append(path)
+        stats.append(path_stats(events.iloc[test_indices], path["y_true"], path["y_pred"], path["y_pred_proba"]))
+    logging.info(f"CPCV for {type(clf).__name__}: {len(splits)} combinations, {len(paths)} backtest paths")
+    return paths, stats
+
+
 def get_roc_curve(clf, y_test, y_pred):
     fpr, tpr, _ = roc_curve(y_test, y_pred)
 
@@ -72,6 +218,9 @@ def get_reports(
     test_procedure,
     use_alpha,
     hyper_params,
+    num_threads=1,
+    warm_start=False,
+    backend=None,
 ):
     logging.info(f"Getting reports for {type(clf).__name__}")
     if test_procedure == "simple":
@@ -79,11 +228,20 @@ def get_reports(
     elif test_procedure == "walk_forward":
         cv = PurgedWalkForwardCV(n_splits=5, n_test_splits=1, min_train_splits=1)
     elif test_procedure == "cpcv":
-        cv = CombPurgedKFoldCV(n_splits=5, n_test_splits=1)
+        # Two test groups out of six: 15 combinations making up 5 backtest paths
+        cv = CombPurgedKFoldCV(n_splits=6, n_test_splits=2)
 
-    y_test, y_pred, y_pred_proba, test_indices = run_val(
-        cv, events_test, clf, X_train, y_train, X_test, y_test
-    )
+    cpcv_stats = None
+    if test_procedure == "cpcv":
+        paths, cpcv_stats = run_cpcv(cv, events_test, clf, X_train, y_train, X_test, y_test, num_threads, backend)
+        # The first path backtests the whole test set, like the predictions of the other procedures
+        y_test, y_pred, y_pred_proba, test_indices = [
+            paths[0][k] for k in ["y_true", "y_pred", "y_pred_proba", "test_indices"]
+        ]
+    else:
+        y_test, y_pred, y_pred_proba, test_indices = run_val(
+            cv, events_test, clf, X_train, y_train, X_test, y_test, num_threads, warm_start, backend
+        )
 
     events = prep_events(events_test.iloc[test_indices], y_pred_proba, y_pred)
 
@@ -100,6 +258,8 @@ def get_reports(
         "roc_auc_score": roc_auc_score(y_test, y_pred_proba),
         "hyper_params": hyper_params,
     }
+    if cpcv_stats is not None:
+        with_ml["cpcv_paths"] = cpcv_stats
     if not use_alpha:
         return {"primary": with_ml, "secondary": None, "events": events}
 
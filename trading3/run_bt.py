@@ -1,13 +1,14 @@
 __all__ = ['downsample', 'alpha', 'join_importances', 'pick_good_features', 'combine_symbol_decks', 'train_test_split',
            'binarize', 'prepare_payload', 'get_symbols_list', 'abort_early', 'parse_config', 'FORMAT', 'SYMBOL_GROUPS',
-           'load_sample_and_binarize', 'run_feature_engineering', 'prepare_alpha_bins_feature_imps', 'run_ml_pipe',
-           'IGNORE_SYMBOLS', 'run_bt']
+           'load_symbol_deck', 'load_sample_and_binarize', 'run_feature_engineering', 'prepare_alpha_bins_feature_imps',
+           'run_ml_pipe', 'IGNORE_SYMBOLS', 'run_bt']
 
 # Cell
 import numpy as np
 import pandas as pd
 import logging
 import random
+from concurrent.futures import ProcessPoolExecutor
 from datetime import date
 from dateutil.relativedelta import relativedelta
 
@@ -19,23 +20,21 @@ from .load_data import (
     load_events_b,
     save_events_b,
     feat_safe_name,
-    load_feat,
-    save_feat,
     load_imp,
     save_imp,
     load_payload,
     save_payload,
 )
 from .filters import cusum
-from .multiprocess import mp_pandas_obj
+from .multiprocess import mp_pandas_obj, shutdown_pools
 from .utils import get_daily_vol, NumpyEncoder
 from .get_bins import get_bins, drop_labels
 from .alpha import ma_alpha, bb_alpha
 from .binarize import triple_barrier_method, fixed_horizon
-from .feature_eng import engineer_feature, define_feature_configs
+from .feature_eng import engineer_deck_features, define_feature_configs
 from .reporting import get_reports
 from .models import get_model
-from .feature_importance import feat_importance
+from .feature_importance import feat_importance, cluster_features, cluster_representatives
 
 FORMAT = "%(asctime)-15s %(message)s"
 logging.basicConfig(format=FORMAT, level=logging.DEBUG)
@@ -53,6 +52,9 @@ SYMBOL_GROUPS = {
 def downsample(bars, type_, daily_vol):
     if type_ == "cusum":
         return cusum(bars["Close"], daily_vol.mean())
+    elif type_ == "cusum-vol":
+        # Log-price CUSUM whose threshold follows the daily volatility instead of its full-sample mean
+        return cusum(np.log(bars["Close"]), daily_vol)
 
     return bars.index
 
@@ -156,7 +158,7 @@ def train_test_split(bars, events, feats, bins, start_date=None, end_date=None):
     return (events_train, X_train, y_train, events_test, X_test, y_test)
 
 
-def binarize(bars, t_events, type_, binarize_params, daily_vol, num_threads):
+def binarize(bars, t_events, type_, binarize_params, daily_vol, num_threads, backend=None):
     """
     Binarize the rows, i.e. for every row determine a forward returns window which
     is then used to calculate that row's label
@@ -165,7 +167,7 @@ def binarize(bars, t_events, type_, binarize_params, daily_vol, num_threads):
         return fixed_horizon(t_events, binarize_params)
     elif type_ == "triple_barrier_method":
         return triple_barrier_method(
-            bars, t_events, binarize_params, daily_vol, num_threads
+            bars, t_events, binarize_params, daily_vol, num_threads, backend
         )
 
 
@@ -232,12 +234,30 @@ def parse_config(data):
         "skip_feature_imp": data.get("skip_feature_imp", False),
         "reuse_hypers": data.get("reuse_hypers", True),
         "hypers_n_iter": data.get("hypers_n_iter", 25),
+        "hyper_search": data.get("hyper_search", "random"),
+        "halving_factor": data.get("halving_factor", 3),
+        "halving_resource": data.get("halving_resource", "n_samples"),
+        "hyper_trials": data.get("hyper_trials", False),
         "load_from_disk": data.get("load_from_disk", True),
         "save_to_disk": data.get("save_to_disk", True),
         "optimize_hypers": data.get("optimize_hypers", True),
         "feat_imp_method": data.get("feat_imp_method", "MDA"),
         "feat_imp_cv": data.get("feat_imp_cv", 5),
+        "feat_imp_n_estimators": data.get("feat_imp_n_estimators", 1000),
+        "feat_imp_repeats": data.get("feat_imp_repeats", 1),
+        "feat_imp_adaptive": data.get("feat_imp_adaptive", False),
+        "feat_imp_tol": data.get("feat_imp_tol", 0.01),
+        "feat_imp_clustered": data.get("feat_imp_clustered", False),
+        "feat_cluster_method": data.get("feat_cluster_method", "corr"),
+        "feat_cluster_threshold": data.get("feat_cluster_threshold", 0.5),
+        "feat_representatives": data.get("feat_representatives", False),
         "num_threads": data.get("num_threads", 32),
+        "symbol_workers": data.get("symbol_workers", 1),
+        "mp_backend": data.get("mp_backend"),
+        "feature_workers": data.get("feature_workers", 1),
+        "val_workers": data.get("val_workers", 1),
+        "val_warm_start": data.get("val_warm_start", False),
+        "incremental_features": data.get("incremental_features", True),
         "n_jobs": data.get("n_jobs", 4),
         "check_completed": data.get("check_completed", False),
     }
@@ -250,55 +270,72 @@ def parse_config(data):
 IGNORE_SYMBOLS = ["@LH#C"]
 
 
+def load_symbol_deck(symbol, config, num_threads):
+    """Load (or sample, downsample & binarize) a single symbol's bars and events"""
+    bars = load_bars(symbol, config)
+    if bars is None:
+        bars, bar_size = load_and_sample_bars(symbol, config["start_date"], config["end_date"], config["bar_type"])
+        save_bars(symbol, config, bars)
+
+    events_b = load_events_b(symbol, config)
+    if events_b is None:
+        daily_vol = get_daily_vol(bars["Close"], config["vol_estimate"])
+        t_events = downsample(bars, config["downsampling"], daily_vol)
+        logging.info(f"{symbol}: Downsampled from {len(bars)} to {len(t_events)}")
+
+        logging.debug(f"{symbol}: Binarize {config['binarize']}")
+        events_b = binarize(
+            bars,
+            t_events,
+            config["binarize"],
+            config["binarize_params"],
+            daily_vol,
+            num_threads,
+            config["mp_backend"],
+        )
+
+        save_events_b(symbol, config, events_b)
+
+    logging.info(f"{symbol}: Have {bars.shape[0]} bars and {events_b.shape[0]} binarized events")
+    return {'bars': bars, 'events_b': events_b}
+
+
 def load_sample_and_binarize(config):
     """
     Load our bars, chunk them into dollar bars aiming to have 50 bars per day per symbol for the year 2019.
     These bars are then CUSUM downsampled and binarized before being saved for later runs.
+    With config["symbol_workers"] > 1 the symbols are processed concurrently, each worker getting
+    an equal share of num_threads for its own multiprocessed steps.
     """
     symbols = get_symbols_list(config)
 
     logging.info(f"Symbols: {symbols}")
-    deck = {}
-    for symbol in symbols:
-        bars = load_bars(symbol, config)
-        if bars is None:
-            bars, bar_size = load_and_sample_bars(symbol, config["start_date"], config["end_date"], config["bar_type"])
-            save_bars(symbol, config, bars)
-
-        events_b = load_events_b(symbol, config)
-        if events_b is None:
-            daily_vol = get_daily_vol(bars["Close"], config["vol_estimate"])
-            t_events = downsample(bars, config["downsampling"], daily_vol)
-            logging.info(f"{symbol}: Downsampled from {len(bars)} to {len(t_events)}")
-
-            logging.debug(f"{symbol}: Binarize {config['binarize']}")
-            events_b = binarize(
-                bars,
-                t_events,
-                config["binarize"],
-                config["binarize_params"],
-                daily_vol,
-                config["num_threads"],
-            )
-
-            save_events_b(symbol, config, events_b)
-
-        logging.info(f"{symbol}: Have {bars.shape[0]} bars and {events_b.shape[0]} binarized events")
-        deck[symbol] = {'bars': bars, 'events_b': events_b}
+    symbol_workers = min(config["symbol_workers"], len(symbols))
+    if symbol_workers <= 1:
+        return {symbol: load_symbol_deck(symbol, config, config["num_threads"]) for symbol in symbols}
+
+    num_threads = max(1, config["num_threads"] // symbol_workers)
+    logging.info(f"Loading {len(symbols)} symbols on {symbol_workers} workers with num_threads={num_threads} each")
+    # Every symbol is queued right away, so while some workers are busy sampling and binarizing,
+    # the others are already reading the next symbols' data from disk
+    with ProcessPoolExecutor(max_workers=symbol_workers) as executor:
+        futures = [executor.submit(load_symbol_deck, symbol, config, num_threads) for symbol in symbols]
+        # Keep the deck in symbol order, combine_symbol_decks relies on it
+        deck = {symbol: future.result() for symbol, future in zip(symbols, futures)}
 
     return deck
 
 
 def run_feature_engineering(config, deck):
     """Load already-engineered features or engineer if we can't"""
+    logging.debug(f"Feature engineering on {config['feature_workers']} workers")
+    engineered = engineer_deck_features(
+        deck, config, config["feature_workers"], config["mp_backend"] or "processes"
+    )
     for symbol, symbol_deck in deck.items():
-        logging.debug(f"{symbol}: Feature engineering")
-        bars = symbol_deck['bars']
         feats = []
-        for feat_config in config["features"]:
-            # We pass a copy in so the feat_eng code can modify that to its hearts content,
-            # while for us the information remains non-redundant
-            feat = engineer_feature(deck, symbol, config, feat_config.copy())["Close"]
+        for feat_config, feat in zip(config["features"], engineered[symbol]):
+            feat = feat["Close"]
             feat.name = feat_safe_name(feat_config)
             feats.append(feat)
         feats2 = pd.concat(feats, axis=1)
@@ -339,10 +376,17 @@ def prepare_alpha_bins_feature_imps(config, deck):
                     events_train,
                     X_train,
                     y_train,
+                    n_estimators=config["feat_imp_n_estimators"],
                     cv=config["feat_imp_cv"],
                     method=config["feat_imp_method"],
                     num_threads=config["num_threads"],
-
+                    n_repeats=config["feat_imp_repeats"],
+                    adaptive=config["feat_imp_adaptive"],
+                    tol=config["feat_imp_tol"],
+                    clustered=config["feat_imp_clustered"],
+                    cluster_method=config["feat_cluster_method"],
+                    cluster_threshold=config["feat_cluster_threshold"],
+                    backend=config["mp_backend"],
                 )
                 save_imp(symbol, config, imp)
 
@@ -374,6 +418,11 @@ def run_ml_pipe(config, deck):
         # Important feats
         imp_all = join_importances(deck)
         cols = pick_good_features(imp_all, X_train.columns, config["feat_imp_method"])
+        if config["feat_representatives"]:
+            # One feature of every cluster of substitutes is enough for the model
+            clusters = cluster_features(X_train[cols], config["feat_cluster_method"], config["feat_cluster_threshold"])
+            cols = cluster_representatives(X_train[cols], clusters)
+            logging.info(f"Kept {len(cols)} cluster representatives: {cols}")
         X_train, X_test = X_train[cols], X_test[cols]
 
     del deck
@@ -397,6 +446,10 @@ def run_ml_pipe(config, deck):
         config["num_threads"],
         config["n_jobs"],
         hyper_params,
+        config["hyper_search"],
+        config["halving_factor"],
+        config["halving_resource"],
+        config["hyper_trials"],
     )
 
     reports = get_reports(
@@ -409,6 +462,9 @@ def run_ml_pipe(config, deck):
         config["test_procedure"],
         config["alpha"] != "none",
         hyper_params,
+        config["val_workers"],
+        config["val_warm_start"],
+        config["mp_backend"],
     )
 
     saved_path = ""
@@ -427,13 +483,17 @@ def run_bt(**data):
     if abort_early(config):
         return ''
 
-    # We store every symbol's data and computations in a central "deck" dictionary
-    deck = load_sample_and_binarize(config)
+    try:
+        # We store every symbol's data and computations in a central "deck" dictionary
+        deck = load_sample_and_binarize(config)
 
-    deck = run_feature_engineering(config, deck)
-    if config['feature_calc_only']:
-        return ''
+        deck = run_feature_engineering(config, deck)
+        if config['feature_calc_only']:
+            return ''
 
-    deck = prepare_alpha_bins_feature_imps(config, deck)
-    payload_path = run_ml_pipe(config, deck)
+        deck = prepare_alpha_bins_feature_imps(config, deck)
+        payload_path = run_ml_pipe(config, deck)
+    finally:
+        # The worker pools are shared by all symbols & stages of this run
+        shutdown_pools()
     return payload_path
\ No newline at end of file
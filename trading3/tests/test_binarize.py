@@ -0,0 +1,66 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from trading3.binarize import apply_pt_sl_on_t1  # noqa: E402
+
+
+def reference_pt_sl_on_t1(close, events, pt_sl, molecule):
+    """The original loop, slicing close for every event"""
+    events_ = events.loc[molecule]
+    out = events_[["t1"]].copy(deep=True)
+    pt = pt_sl[0] * events_["trgt"] if pt_sl[0] > 0 else pd.Series(np.nan, index=events.index)
+    sl = -pt_sl[1] * events_["trgt"] if pt_sl[1] > 0 else pd.Series(np.nan, index=events.index)
+    for loc, t1 in events_["t1"].fillna(close.index[-1]).items():
+        df0 = close[loc:t1]  # path prices
+        df0 = (df0 / close[loc] - 1) * events_.at[loc, "side"]  # path returns
+        out.loc[loc, "sl"] = df0[df0 < sl[loc]].index.min()  # earliest stop loss
+        out.loc[loc, "pt"] = df0[df0 > pt[loc]].index.min()  # earliest profit take
+    return out
+
+
+def close_and_events(n=5000, n_events=300, seed=0):
+    rng = np.random.RandomState(seed)
+    index = pd.date_range("2020-01-01", periods=n, freq="15min")
+    close = pd.Series(100 * np.exp(np.cumsum(rng.normal(0, 2e-3, n))), index=index)
+    starts = np.sort(rng.choice(n, n_events, replace=False))
+    ends = np.minimum(starts + rng.randint(0, 400, n_events), n - 1)
+    events = pd.DataFrame(
+        {
+            "t1": index[ends],
+            "trgt": rng.uniform(0.002, 0.02, n_events),
+            "side": rng.choice([-1.0, 1.0], n_events),
+        },
+        index=index[starts],
+    )
+    # Open events run to the end of the data
+    events.iloc[-10:, events.columns.get_loc("t1")] = pd.NaT
+    return close, events
+
+
+def as_ns(column):
+    return pd.to_datetime(column).values.astype("datetime64[ns]").view("i8")
+
+
+@pytest.mark.parametrize("pt_sl", [(1, 1), (2, 0.5), (1, 0), (0, 1), (0, 0)])
+def test_touches_match_reference(pt_sl):
+    close, events = close_and_events()
+    out = apply_pt_sl_on_t1(close, events, pt_sl, events.index)
+    expected = reference_pt_sl_on_t1(close, events, pt_sl, events.index)
+    pd.testing.assert_index_equal(out.index, expected.index)
+    for column in ["t1", "sl", "pt"]:
+        np.testing.assert_array_equal(as_ns(out[column]), as_ns(expected[column]), err_msg=column)
+
+
+def test_touches_match_reference_on_a_molecule():
+    close, events = close_and_events(seed=1)
+    molecule = events.index[50:120]
+    out = apply_pt_sl_on_t1(close, events, (1, 1), molecule)
+    expected = reference_pt_sl_on_t1(close, events, (1, 1), molecule)
+    for column in ["t1", "sl", "pt"]:
+        np.testing.assert_array_equal(as_ns(out[column]), as_ns(expected[column]), err_msg=column)
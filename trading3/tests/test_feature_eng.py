@@ -0,0 +1,61 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+try:
+    from trading3.feature_eng import autocorr, rolling_autocorr  # noqa: E402
+except (ImportError, OSError) as e:
+    # Needs mlfinlab and the symbols list in DATA_DIR
+    pytest.skip(f"feature_eng can't be imported: {e}", allow_module_level=True)
+
+
+def reference_autocorr(close, window, lag):
+    """The original rolling apply, building a Series for every window"""
+    return close.rolling(window).apply(lambda x: x.autocorr(lag=lag), raw=False)
+
+
+def flat_pairs(close, window, lag):
+    """Windows where either the leading or the lagged prices don't move"""
+    n = window - lag
+    flat = close.rolling(n).max() == close.rolling(n).min()
+    return (flat | flat.shift(lag).fillna(False).astype(bool)).values
+
+
+def prices(n=3000, seed=0):
+    rng = np.random.RandomState(seed)
+    index = pd.date_range("2020-01-01", periods=n, freq="15min")
+    close = pd.Series(2000 * np.exp(np.cumsum(rng.normal(0, 1e-3, n))), index=index, name="Close")
+    # Prices that don't move for a while, where the correlation is undefined
+    close.iloc[1000:1300] = close.iloc[1000]
+    return close
+
+
+PAIRS = [(50, 1), (50, 25), (50, 48), (50, 49), (50, 50), (100, 10), (250, 50)]
+
+
+def test_rolling_autocorr_matches_reference():
+    close = prices()
+    out = rolling_autocorr(close, PAIRS)
+    for window, lag in PAIRS:
+        expected = reference_autocorr(close, window, lag).values
+        flat = flat_pairs(close, window, lag) if window - lag >= 2 else np.zeros(len(close), dtype=bool)
+        # Where a side doesn't move the correlation is undefined. The original gives whatever rounding makes
+        # of it there, which depends on the pandas version (1.0 through np.corrcoef in 0.23, ~1e-14 in recent ones)
+        assert np.isnan(out[(window, lag)].values[flat]).all()
+        # Rolling sums over a handful of pairs lose digits to cancellation
+        atol = 1e-9 if window - lag >= 10 else 1e-5
+        np.testing.assert_allclose(out[(window, lag)].values[~flat], expected[~flat], rtol=1e-7, atol=atol,
+                                   err_msg=str((window, lag)))
+
+
+def test_autocorr_feature_matches_reference():
+    close = prices(seed=1)
+    close.iloc[1000:1300] += np.linspace(0, 1, 300)
+    feat = autocorr(close.to_frame(), 100, 10)
+    pd.testing.assert_index_equal(feat.index, close.index)
+    np.testing.assert_allclose(feat.values, reference_autocorr(close, 100, 10).values, rtol=1e-7, atol=1e-9)
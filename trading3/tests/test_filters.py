@@ -0,0 +1,74 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from trading3.filters import cusum, cusum_kernel  # noqa: E402
+from trading3.utils import get_daily_vol  # noqa: E402
+
+
+def reference_cusum(g_raw, h):
+    """The original loop, with the upward branch checking s_pos"""
+    t_events, s_pos, s_neg = [], 0, 0
+    diff = g_raw.diff()
+    for i in diff.index[1:]:
+        h_i = h.loc[i] if isinstance(h, pd.Series) else h
+        s_pos, s_neg = max(0, s_pos + diff.loc[i]), min(0, s_neg + diff.loc[i])
+        if s_neg < -h_i:
+            s_neg = 0
+            t_events.append(i)
+        elif s_pos > h_i:
+            s_pos = 0
+            t_events.append(i)
+    return pd.DatetimeIndex(t_events)
+
+
+def random_walk(n=5000, seed=0, gaps=False):
+    rng = np.random.RandomState(seed)
+    index = pd.date_range("2020-01-01", periods=n, freq="15min")
+    close = pd.Series(100 * np.exp(np.cumsum(rng.normal(0, 1e-3, n))), index=index)
+    if gaps:
+        close.iloc[rng.choice(n, n // 50, replace=False)] = np.nan
+    return close
+
+
+@pytest.mark.parametrize("gaps", [False, True])
+@pytest.mark.parametrize("h", [0.05, 0.2])
+def test_cusum_constant_threshold(gaps, h):
+    close = random_walk(gaps=gaps)
+    events = cusum(close, h)
+    pd.testing.assert_index_equal(events, reference_cusum(close, h))
+    assert len(events) > 0
+
+
+@pytest.mark.parametrize("gaps", [False, True])
+def test_cusum_series_threshold(gaps):
+    close = random_walk(seed=1, gaps=gaps)
+    h = pd.Series(np.linspace(0.05, 0.3, len(close)), index=close.index)
+    # Thresholds are aligned to the prices, so a reversed series must give the same events
+    pd.testing.assert_index_equal(cusum(close, h.iloc[::-1]), reference_cusum(close, h))
+
+
+def test_cusum_vol():
+    # As downsample does for 'cusum-vol': log prices against the daily volatility
+    close = random_walk(n=20000, seed=2)
+    daily_vol = get_daily_vol(close)
+    events = cusum(np.log(close), daily_vol)
+    pd.testing.assert_index_equal(events, reference_cusum(np.log(close), daily_vol.reindex(close.index)))
+    assert len(events) > 0
+
+
+def test_cusum_upward_shifts_emit_events():
+    # With the old `s_neg > h` test a steadily rising series never produced an event
+    close = pd.Series(np.arange(100, dtype=np.float64), index=pd.date_range("2020", periods=100, freq="D"))
+    assert len(cusum(close, 10)) == 9
+
+
+def test_cusum_kernel_nan_resets():
+    diff = np.array([np.nan, 1.0, 1.0, np.nan, 1.0, 1.0, 1.0])
+    events = cusum_kernel(diff, np.full(diff.shape[0], 2.5))
+    assert events.tolist() == [False, False, False, False, False, False, True]
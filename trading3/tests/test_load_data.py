@@ -0,0 +1,82 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+from path import Path
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+try:
+    from trading3 import load_data  # noqa: E402
+except (ImportError, OSError) as e:
+    # Needs mlfinlab and the symbols list in DATA_DIR
+    pytest.skip(f"load_data can't be imported: {e}", allow_module_level=True)
+
+CONFIG = {"bar_type": "dollar", "load_from_disk": True, "save_to_disk": True}
+
+
+@pytest.fixture(autouse=True)
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(load_data, "DATA_DIR", Path(str(tmp_path)))
+
+
+def frame(n, **columns):
+    index = pd.date_range("2020-01-01", periods=n, freq="min")
+    return pd.DataFrame({k: np.asarray(v, dtype=np.float64)[:n] for k, v in columns.items()}, index=index)
+
+
+def stored():
+    return load_data.load_feat_store("ES", CONFIG)
+
+
+def test_recomputed_features_replace_stored_values():
+    load_data.save_feat_store("ES", CONFIG, frame(10, f=np.arange(10)))
+    load_data.save_feat_store("ES", CONFIG, frame(10, f=np.arange(10) * 100))
+    feats, _ = stored()
+    np.testing.assert_array_equal(feats["f"].values, np.arange(10) * 100)
+
+
+def test_recomputed_features_replace_stored_values_on_new_rows():
+    load_data.save_feat_store("ES", CONFIG, frame(10, f=np.arange(10), g=np.arange(10)))
+    load_data.save_feat_store("ES", CONFIG, frame(15, f=np.arange(15) * 100))
+    feats, ends = stored()
+    np.testing.assert_array_equal(feats["f"].values, np.arange(15) * 100)
+    # g is left behind until it gets updated
+    np.testing.assert_array_equal(feats["g"].values[:10], np.arange(10))
+    assert ends["g"] == feats.index[9] and ends["f"] == feats.index[14]
+
+
+def test_shorter_recomputed_features_are_cleared_past_their_end():
+    load_data.save_feat_store("ES", CONFIG, frame(10, f=np.arange(10), g=np.arange(10)))
+    load_data.save_feat_store("ES", CONFIG, frame(6, f=np.arange(6) * 100))
+    feats, ends = stored()
+    np.testing.assert_array_equal(feats["f"].values[:6], np.arange(6) * 100)
+    assert feats["f"].iloc[6:].isnull().all()
+    assert ends["f"] == feats.index[5]
+
+
+def test_resumed_features_only_append_new_rows():
+    load_data.save_feat_store("ES", CONFIG, frame(10, f=np.arange(10)))
+    # Only the values past the stored ones are written for resumed features
+    load_data.save_feat_store("ES", CONFIG, frame(15, f=np.arange(15) * 100), resumed={"f"})
+    feats, ends = stored()
+    np.testing.assert_array_equal(feats["f"].values, np.r_[np.arange(10), np.arange(10, 15) * 100])
+    assert ends["f"] == feats.index[14]
+
+
+def test_new_columns_keep_stored_ones():
+    load_data.save_feat_store("ES", CONFIG, frame(10, f=np.arange(10)))
+    load_data.save_feat_store("ES", CONFIG, frame(12, g=np.arange(12)))
+    feats, ends = stored()
+    np.testing.assert_array_equal(feats["f"].values[:10], np.arange(10))
+    np.testing.assert_array_equal(feats["g"].values, np.arange(12))
+    assert ends["f"] == feats.index[9]
+
+
+def test_no_tmp_files_are_left_behind(tmp_path):
+    load_data.save_feat_store("ES", CONFIG, frame(10, f=np.arange(10)))
+    load_data.save_feat_store("ES", CONFIG, frame(12, f=np.arange(12)))
+    path = load_data.feat_store_path("ES", CONFIG)
+    assert sorted(x.basename() for x in path.dirname().files()) == [path.basename(), f"{path.basename()}.lock"]
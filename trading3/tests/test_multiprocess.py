@@ -0,0 +1,80 @@
+import os
+import sys
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from trading3 import multiprocess  # noqa: E402
+from trading3.multiprocess import SharedArg, shared_args  # noqa: E402
+
+
+def is_mapped(arr):
+    while arr is not None:
+        if isinstance(arr, np.memmap):
+            return True
+        arr = arr.base
+    return False
+
+
+def test_attached_frame_columns_are_views(tmp_path):
+    index = pd.date_range("2020-01-01", periods=1000, freq="min")
+    df = pd.DataFrame(
+        {
+            "Open": np.arange(1000.0),
+            "Close": np.arange(1000.0) * 2,
+            "t1": index + pd.Timedelta(hours=1),
+            "side": np.ones(1000, dtype=np.int64),
+            "trgt": np.full(1000, 0.01),
+        },
+        index=index,
+    )
+    attached = SharedArg(df, str(tmp_path)).attach()
+    # The index loses its freq, compared on its values
+    pd.testing.assert_index_equal(attached.index, df.index)
+    pd.testing.assert_index_equal(attached.columns, df.columns)
+    pd.testing.assert_series_equal(attached.dtypes, df.dtypes)
+    for column in df.columns:
+        np.testing.assert_array_equal(attached[column].values, df[column].values)
+    for column in attached.columns:
+        assert is_mapped(attached[column].values), column
+
+
+def test_attached_series_is_a_view(tmp_path):
+    series = pd.Series(np.arange(1000.0), index=pd.date_range("2020-01-01", periods=1000, freq="min"))
+    attached = SharedArg(series, str(tmp_path)).attach()
+    pd.testing.assert_index_equal(attached.index, series.index)
+    np.testing.assert_array_equal(attached.values, series.values)
+    assert is_mapped(attached.values)
+
+
+Usage = namedtuple("Usage", "total used free")
+
+
+def test_shared_args_fall_back_to_the_temp_dir_when_shared_memory_is_full(tmp_path, monkeypatch):
+    full = str(tmp_path / "shm")
+    os.mkdir(full)
+    monkeypatch.setattr(multiprocess, "SHARED_MEMORY_DIR", full)
+    monkeypatch.setattr(multiprocess.shutil, "disk_usage", lambda path: Usage(total=1 << 26, used=1 << 26, free=0))
+    monkeypatch.setattr(multiprocess.tempfile, "tempdir", str(tmp_path))
+    with shared_args({"x": np.arange(1 << 18, dtype=np.float64)}, "processes") as args:
+        assert isinstance(args["x"], SharedArg)
+        assert os.path.dirname(os.path.dirname(args["x"].paths["values"])) == str(tmp_path)
+    assert os.listdir(full) == []
+
+
+def test_shared_dirs_in_use_are_removed_later(tmp_path, monkeypatch):
+    rmtree = multiprocess.shutil.rmtree
+
+    def in_use(path):
+        raise PermissionError(path)
+
+    monkeypatch.setattr(multiprocess.shutil, "rmtree", in_use)
+    with shared_args({"x": np.arange(1 << 18, dtype=np.float64)}, "processes") as args:
+        shared_dir = os.path.dirname(args["x"].paths["values"])
+    assert os.path.isdir(shared_dir)
+    monkeypatch.setattr(multiprocess.shutil, "rmtree", rmtree)
+    multiprocess.remove_shared_dirs()
+    assert not os.path.exists(shared_dir)
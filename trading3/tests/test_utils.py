@@ -0,0 +1,63 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from trading3.utils import PurgedKFold, purged_splits  # noqa: E402
+
+
+def reference_splits(t1, n_splits, pct_embargo):
+    """The original PurgedKFold.split, with positional lookups spelled out"""
+    indices = np.arange(t1.shape[0])
+    mbrg = int(t1.shape[0] * pct_embargo)
+    test_starts = [(i[0], i[-1] + 1) for i in np.array_split(np.arange(t1.shape[0]), n_splits)]
+    for i, j in test_starts:
+        t0 = t1.index[i]
+        test_indices = indices[i:j]
+        maxT1Idx = t1.index.searchsorted(t1.iloc[test_indices].max())
+        train_indices = t1.index.searchsorted(t1[t1 <= t0].index)
+        train_indices = np.concatenate((train_indices, indices[maxT1Idx + mbrg :]))
+        yield train_indices, test_indices
+
+
+def labels(n=2000, seed=0):
+    rng = np.random.RandomState(seed)
+    index = pd.date_range("2020-01-01", periods=n, freq="15min")
+    # Every label ends a random number of bars later, the last ones at the last bar
+    ends = np.minimum(np.arange(n) + rng.randint(1, 50, n), n - 1)
+    return pd.Series(index[ends], index=index)
+
+
+@pytest.mark.parametrize("pct_embargo", [0.0, 0.01])
+@pytest.mark.parametrize("n_splits", [3, 5, 10])
+def test_splits_match_reference(n_splits, pct_embargo):
+    t1 = labels()
+    splits = list(PurgedKFold(n_splits=n_splits, t1=t1, pct_embargo=pct_embargo).split(t1.to_frame()))
+    expected = list(reference_splits(t1, n_splits, pct_embargo))
+    assert len(splits) == len(expected)
+    for (train, test), (train_ref, test_ref) in zip(splits, expected):
+        np.testing.assert_array_equal(test, test_ref)
+        np.testing.assert_array_equal(train, train_ref)
+
+
+def test_open_labels_purge_everything_after_their_fold():
+    t1 = labels(200)
+    t1.iloc[-5:] = pd.NaT
+    t1.iloc[70] = pd.NaT
+    splits = purged_splits(t1, 4, 0.0)
+    for train, test in splits:
+        assert not np.intersect1d(train, test).size
+    # The original split skipped the NaTs when looking for the fold's last label end, which trained the last
+    # fold on its own open labels
+    train_ref, test_ref = list(reference_splits(t1, 4, 0.0))[-1]
+    assert np.intersect1d(train_ref, test_ref).size
+    # The fold holding label 70 isn't followed by anything in train, and label 70 itself is never trained on
+    # by later folds
+    train, test = splits[1]
+    assert train.max() < test[0]
+    for train, test in splits[2:]:
+        assert 70 not in train
@@ -1,9 +1,12 @@
-__all__ = ['NumpyEncoder', 'get_daily_vol', 'PurgedKFold']
+__all__ = ['NumpyEncoder', 'get_daily_vol', 'SPLITS_CACHE_SIZE', 'purged_splits', 'cached_purged_splits', 'PurgedKFold']
 
 # Cell
 import pandas as pd
 import numpy as np
 import json
+import hashlib
+import threading
+from collections import OrderedDict
 
 from sklearn.model_selection._split import _BaseKFold
 
@@ -31,6 +34,56 @@ def get_daily_vol(close, span0=100):
     return df0
 
 
+# Purged splits of the most recently used (t1, n_splits, pct_embargo), searches call split for every candidate
+SPLITS_CACHE_SIZE = 32
+_SPLITS_CACHE = OrderedDict()
+_SPLITS_CACHE_LOCK = threading.Lock()
+
+
+def purged_splits(t1, n_splits, pct_embargo):
+    """
+    Train and test positions (int32) of every fold, with contiguous test folds. Training labels overlapping
+    a test window on either side are purged: those ending after its start and starting before the end of
+    its last label. The pct_embargo of the observations following that end is dropped as well.
+    Labels without an end (NaT) are open, nothing after a test window holding one of them is trained on
+    """
+    index, ends = t1.index.values, t1.values
+    n = index.shape[0]
+    starts = np.array([x[0] for x in np.array_split(np.arange(n), n_splits)])
+    stops = np.append(starts[1:], n)
+    t0 = index[starts]
+    open_ended = np.logical_or.reduceat(pd.isnull(ends), starts)
+    # NaTs are left out of the max explicitly, how they compare and sort depends on the NumPy version
+    max_t1 = np.maximum.reduceat(np.where(pd.isnull(ends), index[0], ends), starts)
+    after = np.where(open_ended, n, index.searchsorted(max_t1) + int(n * pct_embargo))
+    positions = np.arange(n)
+    train = (ends[None, :] <= t0[:, None]) | (positions[None, :] >= after[:, None])
+    splits = []
+    for k in range(len(starts)):
+        test = positions[starts[k] : stops[k]].astype(np.int32)
+        train_k = np.flatnonzero(train[k]).astype(np.int32)
+        # The splits are shared through the cache, so keep anyone from modifying them
+        test.flags.writeable, train_k.flags.writeable = False, False
+        splits.append((train_k, test))
+    return splits
+
+
+def cached_purged_splits(t1, n_splits, pct_embargo):
+    h = hashlib.sha1(t1.index.values.tobytes())
+    h.update(t1.values.tobytes())
+    key = (h.hexdigest(), n_splits, pct_embargo)
+    with _SPLITS_CACHE_LOCK:
+        if key in _SPLITS_CACHE:
+            _SPLITS_CACHE.move_to_end(key)
+            return _SPLITS_CACHE[key]
+    splits = purged_splits(t1, n_splits, pct_embargo)
+    with _SPLITS_CACHE_LOCK:
+        _SPLITS_CACHE[key] = splits
+        while len(_SPLITS_CACHE) > SPLITS_CACHE_SIZE:
+            _SPLITS_CACHE.popitem(last=False)
+    return splits
+
+
 class PurgedKFold(_BaseKFold):
     """
     Extend KFold to work with labels that span intervals
@@ -50,16 +103,5 @@ class PurgedKFold(_BaseKFold):
     def split(self, X, y=None, groups=None):
         if X.shape[0] != self.t1.shape[0]:
             raise ValueError("X and ThruDateValues must have the same index length")
-        indices = np.arange(X.shape[0])
-        mbrg = int(X.shape[0] * self.pct_embargo)
-        test_starts = [
-            (i[0], i[-1] + 1)
-            for i in np.array_split(np.arange(X.shape[0]), self.n_splits)
-        ]
-        for i, j in test_starts:
-            t0 = self.t1.index[i]
-            test_indices = indices[i:j]
-            maxT1Idx = self.t1.index.searchsorted(self.t1[test_indices].max())
-            train_indices = self.t1.index.searchsorted(self.t1[self.t1 <= t0].index)
-            train_indices = np.concatenate((train_indices, indices[maxT1Idx + mbrg :]))
-            yield train_indices, test_indices
\ No newline at end of file
+        for train_indices, test_indices in cached_purged_splits(self.t1, self.n_splits, self.pct_embargo):
+            yield train_indices, test_indices